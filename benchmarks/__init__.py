@@ -0,0 +1 @@
+"""Benchmarks and synthetic data generators, see benchmarks/run.py"""
@@ -0,0 +1,206 @@
+"""Seeded generators of synthetic danmaku files.
+
+Every writer streams its output, so files of millions of comments are written without
+holding the comments in memory, and the same scenario always produces the same bytes.
+"""
+import json
+import random
+import struct
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, timezone
+from typing import BinaryIO, Iterator, NamedTuple, Tuple
+from xml.sax.saxutils import escape, quoteattr
+
+from danmakuC.protobuf.bilibili.reply_pb2 import DanmakuElem
+from danmakuC.protobuf.niconico import NNDCommentProto
+
+__all__ = ['Scenario', 'SCENARIOS', 'generate', 'write_bilibili', 'write_niconico_stream',
+           'write_niconico_json', 'write_niconico_xml', 'WRITERS']
+
+
+@dataclass(frozen=True)
+class Scenario:
+    comments: int = 10_000
+    duration: float = 1440.0    # video length in seconds
+    burst: float = 0.2          # share of comments sent in a few short burst scenes
+    multiline: float = 0.02     # share of long multi-line comments
+    owner_scripts: float = 0.0  # share of owner nicoscript comments (niconico)
+    seed: int = 0
+
+    def with_comments(self, comments: int) -> "Scenario":
+        return replace(self, comments=comments)
+
+
+SCENARIOS = {
+    "normal": Scenario(),
+    "burst": Scenario(burst=0.7),
+    "multiline": Scenario(multiline=0.3),
+    "nicoscript": Scenario(owner_scripts=0.02),
+}
+
+
+class Comment(NamedTuple):
+    progress: float  # seconds
+    ctime: int
+    pos: str         # naka, ue, shita or reverse
+    size: str        # medium, big or small
+    color: int
+    fork: str        # main, easy or owner
+    text: str
+    mail: Tuple[str, ...]
+
+
+PHRASES = [
+    "233333", "2333333333", "哈哈哈哈", "哈哈哈哈哈哈哈哈", "awsl", "前方高能", "草", "www", "wwwwwwww",
+    "8888888", "？？？", "好耶", "泪目", "kksk", "来了来了", "名场面", "典", "弹幕护体", "下次一定",
+    "www草", "かわいい", "うぽつ", "きたああああ", "888888", "神回", "ここすき", "お前らｗｗｗ", "1get",
+]
+CHARS = "abcdefghijklmnopqrstuvwxyz0123456789 あいうえおかきくけこアイウエオ漢字弾幕時間天気好的我你他ｗ！？😀👍{}\\"
+COLORS = [0xFFFFFF] * 16 + [0xFF0000, 0x00FF00, 0x0000FF, 0xFFFF00, 0x000000, 0xFE0000, 0x66CCFF]
+NICO_COLORS = ["red", "pink", "orange", "yellow", "green", "cyan", "blue", "purple", "black", "white2", "#66ccff"]
+SCRIPTS = [
+    "@デフォルト",
+    "＠置換 草 www 全 部分一致",
+    "@置換 きたああああ キタ━━━━(ﾟ∀ﾟ)━━━━!! 単 コメ 完全一致",
+    "@逆 全",
+]
+
+
+def _text(rnd: random.Random, multiline: float) -> str:
+    r = rnd.random()
+    if r < multiline:
+        lines = ["".join(rnd.choice(CHARS) for _ in range(rnd.randint(8, 30))) for _ in range(rnd.randint(3, 8))]
+        if rnd.random() < 0.2:
+            lines[0] = "\t" + lines[0]
+        return "\n".join(lines)
+    # danmaku text is heavily repetitive
+    if r < 0.75:
+        return PHRASES[min(int(rnd.paretovariate(1.2)) - 1, len(PHRASES) - 1)]
+    return "".join(rnd.choice(CHARS) for _ in range(rnd.randint(1, 24)))
+
+
+def generate(scenario: Scenario) -> Iterator[Comment]:
+    """comments of a scenario in sending order (by ctime)"""
+    rnd = random.Random(scenario.seed)
+    bursts = [rnd.uniform(0, scenario.duration) for _ in range(max(1, int(scenario.duration // 240)))]
+    start = 1_600_000_000
+    for i in range(scenario.comments):
+        if rnd.random() < scenario.burst:
+            progress = min(max(rnd.gauss(rnd.choice(bursts), 4.0), 0), scenario.duration)
+        else:
+            progress = rnd.uniform(0, scenario.duration)
+        ctime = start + i * 3 + rnd.randint(0, 2)
+        r = rnd.random()
+        pos = "naka" if r < 0.86 else "ue" if r < 0.92 else "shita" if r < 0.98 else "reverse"
+        r = rnd.random()
+        size = "medium" if r < 0.9 else "big" if r < 0.95 else "small"
+        fork = "main" if rnd.random() < 0.8 else "easy"
+        if rnd.random() < scenario.owner_scripts:
+            fork = "owner"
+            text = rnd.choice(SCRIPTS)
+            mail = ("@" + str(rnd.randint(5, 60)),)
+            yield Comment(progress, ctime, pos, size, 0xFFFFFF, fork, text, mail)
+            continue
+        color = rnd.choice(COLORS)
+        mail = ["184"] if rnd.random() < 0.5 else []
+        if pos != "naka" or rnd.random() < 0.1:
+            mail.append(pos if pos != "reverse" else "naka")
+        if size != "medium":
+            mail.append(size)
+        if rnd.random() < 0.1:
+            mail.append(rnd.choice(NICO_COLORS))
+        if rnd.random() < 0.02:
+            mail.append(rnd.choice(["mincho", "gothic", "full", "ender", "invisible"]))
+        yield Comment(progress, ctime, pos, size, color, fork, _text(rnd, scenario.multiline), tuple(mail))
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+BILI_MODES = {"naka": 1, "ue": 5, "shita": 4, "reverse": 6}
+BILI_SIZES = {"medium": 25, "big": 36, "small": 18}
+
+
+def write_bilibili(fp: BinaryIO, scenario: Scenario):
+    """one DmSegMobileReply, its elems are written one by one as repeated field 1"""
+    rnd = random.Random(scenario.seed + 1)
+    for i, c in enumerate(generate(scenario)):
+        elem = DanmakuElem()
+        elem.id = 10 ** 15 + i
+        elem.progress = int(c.progress * 1000)
+        r = rnd.random()
+        # advanced (7) and code (8) comments are rare, the code ones are skipped by the converter
+        elem.mode = 7 if r < 0.005 else 8 if r < 0.01 else BILI_MODES[c.pos]
+        elem.fontsize = BILI_SIZES[c.size]
+        elem.color = c.color
+        elem.midHash = f"{rnd.getrandbits(32):08x}"
+        elem.content = c.text
+        elem.ctime = c.ctime
+        elem.weight = rnd.randint(1, 10)
+        elem.pool = 1 if r > 0.995 else 0
+        elem.idStr = str(elem.id)
+        elem.attr = 4 if rnd.random() < 0.05 else 0
+        data = elem.SerializeToString()
+        fp.write(b'\x0a' + _varint(len(data)) + data)
+
+
+def write_niconico_stream(fp: BinaryIO, scenario: Scenario):
+    """length-prefixed NNDComment messages"""
+    for i, c in enumerate(generate(scenario)):
+        comment = NNDCommentProto()
+        comment.thread, comment.no, comment.vpos, comment.date = 1, i + 1, int(c.progress * 100), c.ctime
+        comment.user_id, comment.mail, comment.content, comment.fork = f"u{i % 5000}", " ".join(c.mail), c.text, c.fork
+        data = comment.SerializeToString()
+        fp.write(struct.pack('>I', len(data)) + data)
+
+
+def write_niconico_json(fp: BinaryIO, scenario: Scenario):
+    """nvComment api response, one thread per fork"""
+    tz = timezone(timedelta(hours=9))
+    fp.write(b'{"meta": {"status": 200}, "data": {"threads": [')
+    # the generator is deterministic, so each fork is generated again instead of kept in memory
+    for t, fork in enumerate(["owner", "main", "easy"]):
+        fp.write(b', ' if t else b'')
+        fp.write(f'{{"id": "{t + 1}", "fork": "{fork}", "comments": ['.encode())
+        n = 0
+        for i, c in enumerate(generate(scenario)):
+            if c.fork != fork:
+                continue
+            comment = {
+                "id": str(i + 1), "no": i + 1, "vposMs": int(c.progress * 1000), "body": c.text,
+                "commands": list(c.mail), "userId": f"u{i % 5000}", "isPremium": False, "score": 0,
+                "postedAt": datetime.fromtimestamp(c.ctime, tz).isoformat(), "nicoruCount": 0,
+            }
+            fp.write((', ' if n else '').encode() + json.dumps(comment, ensure_ascii=False).encode())
+            n += 1
+        fp.write(b']}')
+    fp.write(b']}}')
+
+
+def write_niconico_xml(fp: BinaryIO, scenario: Scenario):
+    """legacy <packet> of <chat> elements"""
+    fp.write(b'<?xml version="1.0" encoding="UTF-8"?>\n<packet>\n')
+    for i, c in enumerate(generate(scenario)):
+        fork = ' fork="owner"' if c.fork == "owner" else ''
+        fp.write(f'<chat thread="1" no="{i + 1}" vpos="{int(c.progress * 100)}" date="{c.ctime}" '
+                 f'mail={quoteattr(" ".join(c.mail))} user_id="u{i % 5000}"{fork}>{escape(c.text)}</chat>\n'
+                 .encode())
+    fp.write(b'</packet>\n')
+
+
+# format name: (writer, file extension, converter path)
+WRITERS = {
+    "bilibili": (write_bilibili, "bin", "danmakuC.bilibili:proto2ass"),
+    "niconico_stream": (write_niconico_stream, "bin", "danmakuC.niconico:proto2ass"),
+    "niconico_json": (write_niconico_json, "json", "danmakuC.niconico:json2ass"),
+    "niconico_xml": (write_niconico_xml, "xml", "danmakuC.niconico:xml2ass"),
+}
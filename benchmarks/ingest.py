@@ -0,0 +1,43 @@
+"""Per comment cost of ingestion (decode, filter, escape and measure the text) and of
+layout with serialization, on a bilibili segment.
+
+    python benchmarks/ingest.py [segment] [-n REPEAT]
+"""
+import argparse
+import os
+import time
+
+from danmakuC.ass import Ass
+
+DEFAULT_FILE = os.path.join(os.path.dirname(__file__), os.pardir, 'tests', 'test_dm.bin')
+
+
+def bench(data: bytes, repeat: int):
+    ingest, output = [], []
+    for _ in range(repeat):
+        ass = Ass(1920, 1080, 0, "sans-serif", 25.0, 1.0, 5.0, 5.0, "", False, False, False)
+        t0 = time.perf_counter()
+        counts = ass.add_bilibili_segment(data)
+        t1 = time.perf_counter()
+        ass.to_string()
+        t2 = time.perf_counter()
+        ingest.append(t1 - t0)
+        output.append(t2 - t1)
+    return counts["parsed"], min(ingest), min(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", nargs="?", default=DEFAULT_FILE, help="DmSegMobileReply file [default: tests/test_dm.bin]")
+    parser.add_argument("-n", "--repeat", type=int, default=20, help="Best of REPEAT runs [default: 20]")
+    args = parser.parse_args()
+    with open(args.file, 'rb') as f:
+        data = f.read()
+    n, ingest, output = bench(data, args.repeat)
+    print(f"{n} comments")
+    print(f"ingest:          {ingest * 1e6 / n:8.2f} us/comment  ({ingest * 1e3:.2f} ms)")
+    print(f"layout + output: {output * 1e6 / n:8.2f} us/comment  ({output * 1e3:.2f} ms)")
+
+
+if __name__ == "__main__":
+    main()
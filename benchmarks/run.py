@@ -0,0 +1,164 @@
+"""Benchmark every converter on generated danmaku files and compare with a stored baseline.
+
+    python -m benchmarks.run --sizes 10k,100k,1m --save        # record benchmarks/baseline.json
+    python -m benchmarks.run --sizes 10k,100k,1m               # compare, exit 1 on regressions
+
+Timings and RSS depend on the machine, so no baseline is committed (benchmarks/baseline.json is
+git-ignored): record one locally with --save before comparing. To record it on an older commit,
+run this harness from a built checkout of that commit, converters there that do not take `stats`
+are timed by wall clock only:
+
+    git worktree add ../danmakuC-base <commit>
+    cp -r benchmarks ../danmakuC-base/
+    (cd ../danmakuC-base && python setup.py build_ext --inplace &&
+     python -m benchmarks.run --sizes 10k,100k,1m --save)
+    cp ../danmakuC-base/benchmarks/baseline.json benchmarks/
+
+Each case runs in a fresh process, so the peak RSS of a case is not hidden by the ones before
+it. Generated files are cached in --data-dir.
+"""
+import argparse
+import importlib
+import inspect
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.generators import SCENARIOS, WRITERS
+from danmakuC.__version__ import __version__
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(__file__), ".data")
+
+
+def parse_size(size: str) -> int:
+    size = size.strip().lower()
+    scale = {"k": 10 ** 3, "m": 10 ** 6}.get(size[-1:], 1)
+    return int(float(size.rstrip("km")) * scale)
+
+
+def data_file(data_dir: str, fmt: str, scenario: str, comments: int) -> str:
+    writer, ext, _ = WRITERS[fmt]
+    path = os.path.join(data_dir, f"{fmt}-{scenario}-{comments}.{ext}")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            writer(f, SCENARIOS[scenario].with_comments(comments))
+        os.replace(tmp, path)
+    return path
+
+
+def peak_rss() -> Optional[int]:
+    """peak resident set size of this process in bytes, None where it is not available"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def run_case(converter: str, path: str) -> dict:
+    """convert `path` once in this process, converters without a `stats` argument (before the
+    profiling support, e.g. on an old commit recording a baseline) are only timed"""
+    module, func = converter.split(":")
+    convert = getattr(importlib.import_module(module), func)
+    kwargs = {}
+    stats = {}
+    if "stats" in inspect.signature(convert).parameters:
+        kwargs["stats"] = stats
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        convert(f, 1920, 1080, out_filename=os.devnull, **kwargs)
+    seconds = time.perf_counter() - start
+    ass = stats.get("ass")
+    return {
+        "seconds": seconds,
+        "comments_per_second": ass["comments"]["added"] / seconds if ass and seconds else None,
+        "parser": stats.get("parser"),
+        "phases": ass["phases"] if ass else {},
+        "peak_rss": peak_rss(),
+    }
+
+
+def measure(converter: str, path: str, repeat: int) -> dict:
+    """best of `repeat` runs, each in a new process"""
+    best = None
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-m", "benchmarks.run", "--worker", converter, path],
+                             check=True, capture_output=True, text=True).stdout
+        result = json.loads(out)
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+    return best
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """print results against the baseline and return the regressed cases"""
+    regressions = []
+    print(f"{'case':<36}{'seconds':>10}{'base':>10}{'ratio':>8}{'RSS MiB':>10}{'base':>10}{'ratio':>8}")
+    for case, r in results.items():
+        b = baseline.get(case)
+        line = f"{case:<36}{r['seconds']:>10.3f}"
+        rss = r["peak_rss"] / 2 ** 20 if r["peak_rss"] else float("nan")
+        if b is None:
+            print(line + f"{'-':>10}{'-':>8}{rss:>10.1f}{'-':>10}{'-':>8}")
+            continue
+        time_ratio = r["seconds"] / b["seconds"]
+        rss_ratio = r["peak_rss"] / b["peak_rss"] if r["peak_rss"] and b["peak_rss"] else 1.0
+        base_rss = b["peak_rss"] / 2 ** 20 if b["peak_rss"] else float("nan")
+        mark = ""
+        if time_ratio > 1 + tolerance or rss_ratio > 1 + tolerance:
+            regressions.append(case)
+            mark = "  REGRESSION"
+        print(line + f"{b['seconds']:>10.3f}{time_ratio:>8.2f}{rss:>10.1f}{base_rss:>10.1f}{rss_ratio:>8.2f}{mark}")
+    return regressions
+
+
+def main():
+    if sys.argv[1:2] == ["--worker"]:
+        print(json.dumps(run_case(sys.argv[2], sys.argv[3])))
+        return
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10k,100k", help="Comma separated comment counts, e.g. 10k,1m,10m [default: 10k,100k]")
+    parser.add_argument("--formats", default=",".join(WRITERS), help="Comma separated formats [default: all]")
+    parser.add_argument("--scenarios", default="normal,burst", help=f"Comma separated of {', '.join(SCENARIOS)} [default: normal,burst]")
+    parser.add_argument("--repeat", type=int, default=3, help="Best of REPEAT runs [default: 3]")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="Cache of generated files")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline results, recorded locally with --save [default: benchmarks/baseline.json]")
+    parser.add_argument("--save", action="store_true", help="Store the results as the baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed slowdown or RSS growth [default: 0.15]")
+    args = parser.parse_args()
+
+    results = {}
+    for fmt in args.formats.split(","):
+        for scenario in args.scenarios.split(","):
+            for size in args.sizes.split(","):
+                comments = parse_size(size)
+                path = data_file(args.data_dir, fmt, scenario, comments)
+                results[f"{fmt}/{scenario}/{comments}"] = measure(WRITERS[fmt][2], path, args.repeat)
+
+    if args.save:
+        with open(args.baseline, "w", encoding="utf8") as f:
+            json.dump({"version": __version__, "python": platform.python_version(), "machine": platform.platform(),
+                       "results": results}, f, indent=1)
+    baseline = {}
+    if not args.save:
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf8") as f:
+                baseline = json.load(f)["results"]
+        else:
+            print(f"no baseline at {args.baseline}, record one with --save", file=sys.stderr)
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} regressions over {args.tolerance:.0%}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
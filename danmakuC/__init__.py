@@ -4,3 +4,4 @@ https://github.com/HFrost0/danmakuC
 """
 
 from . import bilibili, niconico
+from .convert import convert, convert_many
@@ -1,48 +1,23 @@
 import argparse
-import gzip
 import os
-from typing import Callable, Union
+import sys
+from typing import List, Optional, Union
 
 from danmakuC.__version__ import __version__
-# sites
-from danmakuC import bilibili, niconico
+from danmakuC.batch import batch_convert
+from danmakuC.convert import get_convert_func
+from danmakuC.profile import format_stats
 
 
-def is_gzip_file(filename: Union[str, os.PathLike]) -> bool:
-    gzip_magic = b'\x1f\x8b'
-    with open(filename, mode='rb') as fp:
-        return fp.read(2) == gzip_magic
+def read_filter_file(filename: Union[str, os.PathLike]) -> List[str]:
+    with open(filename, encoding='utf8') as f:
+        return [line.strip() for line in f if line.strip()]
 
 
-def get_convert_func(file: Union[str, os.PathLike], ) -> Callable:
-    ext = file.split('.')[-1].lower()
-    if ext == "json":
-        return niconico.json2ass
-    if ext == "xml":
-        with open(file, 'rb') as fx:
-            if b"packet" in fx.read(128):
-                return niconico.xml2ass
-            # else:
-            #     return bilibili.xml2ass
-    if is_gzip_file(file):
-        open_func = gzip.open
-    else:
-        open_func = open
-    with open_func(file, mode='rb') as fp:
-        firstbyte = fp.read(1)
-    if firstbyte == b'\x0a':
-        convert_func = bilibili.proto2ass
-    else:
-        convert_func = niconico.proto2ass
-    return convert_func
-
-
-def main():
-    parser = argparse.ArgumentParser(description=f"danmakuC cli version {__version__}", prog="danmakuC")
-    parser.add_argument("file", help="Comment file to be processed")
-    parser.add_argument("-o", "--output", help="Output file")
-
-    parser.add_argument("-s", "--size", type=str, help="Stage size in pixels [default: 1920x1080]", default="1920x1080")
+def add_convert_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("-s", "--size", type=str, default="1920x1080",
+                        help="Stage size in pixels, comma separated sizes render every size to "
+                             "output files with a _WxH suffix [default: 1920x1080]")
     parser.add_argument(
         "-rb", "--reserve-blank", help="Reserve blank on the bottom of the stage [default: 0]", type=int, default=0)
     parser.add_argument(
@@ -74,36 +49,98 @@ def main():
         default=5.0,
     )
     parser.add_argument("-fl", "--filter", help="Regular expression to filter comments", default="")
-    # parser.add_argument(
-    #     "-flf", "--filter-file", help="Regular expressions from file (one line one regex) to filter comments"
-    # )
+    parser.add_argument(
+        "-flf", "--filter-file", help="Regular expressions from file (one line one regex) to filter comments"
+    )
     parser.add_argument("-r", "--reduce", action="store_true", help="Reduce the amount of comments if stage is full")
     parser.add_argument("-b", "--bold", action="store_true", help="Enable boldface for comments")
     parser.add_argument("-lv", "--live", action="store_true", help="Process comments as live streaming format")
+    parser.add_argument("-mw", "--merge-window", type=float, default=0.0,
+                        help="Merge repeated comments within this many seconds into one [default: 0, disabled]")
+    parser.add_argument("-ms", "--merge-style", choices=["count", "scale", "none"], default="count",
+                        help="Show merged comments with a ×N marker, a larger font or as is [default: count]")
+    parser.add_argument("-mps", "--max-per-second", type=int, default=0,
+                        help="Keep at most this many comments starting in a second for each mode, the ones with "
+                             "the lowest priority (not high-liked, low weight, long text) are dropped [default: 0, unlimited]")
+    parser.add_argument("-mos", "--max-on-screen", type=int, default=0,
+                        help="Keep at most this many comments on screen at once for each mode [default: 0, unlimited]")
     parser.add_argument("-v", "--version", action="version", version=f"version {__version__}")
+
+
+def get_convert_kwargs(args: argparse.Namespace) -> dict:
+    """converter keyword arguments from the options of add_convert_arguments"""
+    sizes = [tuple(int(i) for i in size.split("x")) for size in args.size.split(",")]
+    width, height = sizes[0]
+    comment_filter = [args.filter] if args.filter else []
+    if args.filter_file:
+        comment_filter.extend(read_filter_file(args.filter_file))
+    return dict(
+        width=width,
+        height=height,
+        reserve_blank=args.reserve_blank,
+        font_face=args.font,
+        font_size=args.fontsize,
+        alpha=args.alpha,
+        duration_marquee=args.duration_marquee,
+        duration_still=args.duration_still,
+        comment_filter=comment_filter,
+        reduced=args.reduce,
+        bold=args.bold,
+        live=args.live,
+        merge_window=args.merge_window,
+        merge_style=args.merge_style,
+        max_per_second=args.max_per_second,
+        max_on_screen=args.max_on_screen,
+        sizes=sizes if len(sizes) > 1 else None,
+    )
+
+
+def batch_main(argv: List[str]):
+    parser = argparse.ArgumentParser(description="Convert many comment files on a process pool",
+                                     prog="danmakuC batch")
+    parser.add_argument("sources", nargs="+", help="Directories or glob patterns of comment files")
+    parser.add_argument("-o", "--output-dir", required=True, help="Output directory of ass files")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes [default: cpu count]")
+    parser.add_argument("--force", action="store_true", help="Convert unchanged files again")
+    add_convert_arguments(parser)
+    args = parser.parse_args(argv)
+    try:
+        result = batch_convert(args.sources, args.output_dir, max_workers=args.jobs, force=args.force,
+                               **get_convert_kwargs(args))
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"converted {len(result['converted'])}, skipped {len(result['skipped'])}, "
+          f"failed {len(result['failed'])}", file=sys.stderr)
+    if result["failed"]:
+        sys.exit(1)
+
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["batch"]:
+        return batch_main(argv[1:])
+    parser = argparse.ArgumentParser(description=f"danmakuC cli version {__version__}", prog="danmakuC")
+    parser.add_argument("file", help="Comment file to be processed, or `batch` to convert many files")
+    parser.add_argument("-o", "--output", help="Output file, gzip compressed if it ends with .gz")
+    parser.add_argument("--profile", action="store_true", help="Print phase timings and layout counters to stderr")
+    add_convert_arguments(parser)
     # parse args
-    args = parser.parse_args()
-    width, height = args.size.split("x")
-    width = int(width)
-    height = int(height)
+    args = parser.parse_args(argv)
+    if "," in args.size and not args.output:
+        parser.error("several sizes need an output file")
+    stats = {}
 
     with open(args.file, 'rb') as f:
         res = get_convert_func(args.file)(
             f,
-            width,
-            height,
-            args.reserve_blank,
-            args.font,
-            args.fontsize,
-            args.alpha,
-            args.duration_marquee,
-            args.duration_still,
-            args.filter,
-            args.reduce,
-            args.bold,
-            args.live,
+            **get_convert_kwargs(args),
             out_filename=args.output,
+            stats=stats,
         )
+    for pattern, dropped in stats["filters"].items():
+        print(f"filter {pattern!r} dropped {dropped} comments", file=sys.stderr)
+    if args.profile:
+        print(format_stats(stats), file=sys.stderr)
     if res is not None:
         print(res)
 
@@ -1,4 +1,7 @@
 # Defined in csrc/ass.cpp
+# the add_bilibili_* and add_niconico_* decoders and the output methods
+# release the GIL, an Ass object must not be used by several threads at the same time
+from typing import BinaryIO, Callable, Dict, Iterator, List, Sequence, Tuple, Union
 
 class Ass:
     def __init__(self,
@@ -10,14 +13,58 @@ class Ass:
                  alpha: float = 1.0,
                  duration_marquee: float = 5.0,
                  duration_still: float = 5.0,
-                 filter: str = "",
+                 filter: Union[str, Sequence[str]] = "",
                  reduced: bool = False,
                  bold: bool = False,
                  live: bool = False,
                 ): ...
 
-    def add_comment(self, progress: float, ctime: int, content: str, size_factor: float, mode: int, color: int, pool: int) -> bool:
-        """add a comment to Ass object, return True if add success"""
+    reorder_window: float
+    """seconds of the latest comments held back by flush for late arrivals [default: 0]"""
+
+    merge_window: float
+    """repeated comments (same text, mode and pool) within merge_window seconds of the first one are laid out
+    once, 0 disables merging, not applied by flush [default: 0]"""
+
+    max_per_second: int
+    """at most this many comments start in one second on each (pool, mode) stage, the ones with the lowest
+    priority (high-liked, weight, then shorter text first) are dropped, 0 is unlimited [default: 0]"""
+
+    max_on_screen: int
+    """at most this many comments are shown at once on each (pool, mode) stage, 0 is unlimited [default: 0]"""
+
+    workers: int
+    """threads of the layout and serialization of large outputs, 0 is one per core [default: 0]"""
+
+    merge_style: str
+    """how merged comments are shown: "count" appends " ×N", "scale" enlarges the font, "none" [default: count]"""
+
+    header: str
+    """the ass text before the Dialogue lines"""
+
+    def add_filters(self, patterns: List[str]) -> None:
+        """add regular expressions to filter comments, patterns without regex syntax are matched as keywords"""
+        ...
+
+    def add_keyword_filters(self, keywords: List[str]) -> None:
+        """add plain keywords to filter comments"""
+        ...
+
+    def stats(self) -> dict:
+        """phase timings in seconds ("decode", "sort", "layout", "format" of the last layout), comment
+        counts ("added", "filtered", "by_mode", "by_pool"), counters of the last layout ("laid_out",
+        "collisions", "alternative_rows", "stage_clears", "dropped_reduced", "fixed_rows", "merged", "density_dropped", "late" of flush) and memory
+        ("comments_bytes", "body_peak_bytes")"""
+        ...
+
+    def filter_stats(self) -> Dict[str, int]:
+        """return how many comments each filter rule dropped"""
+        ...
+
+    def add_comment(self, progress: float, ctime: int, content: str, size_factor: float, mode: int, color: int, pool: int,
+                    weight: int = 0, attr: int = 0) -> bool:
+        """add a comment to Ass object, return True if add success, weight and attr (bit 2: high-liked) of
+        bilibili comments are their priority for max_per_second and max_on_screen"""
         ...
 
     def add_nico_comment(self, progress: float, duration: float, ctime: int, content: str, font_size: float, mode: int, color: int,
@@ -25,9 +72,68 @@ class Ass:
         """add a niconico-style comment to Ass object, return True if add success"""
         ...
 
+    def add_bilibili_segment(self, buffer: Union[bytes, bytearray, memoryview]) -> Dict[str, int]:
+        """decode a bilibili DmSegMobileReply protobuf natively and add its comments,
+        return counts of parsed, added, filtered and skipped comments"""
+        ...
+
+    def add_niconico_stream(self, buffer: Union[bytes, bytearray, memoryview],
+                            mail_style: Callable[[str], Tuple[int, float, int]]) -> Dict[str, int]:
+        """decode a length-prefixed NNDComment stream natively and add its comments, mail_style resolves
+        each distinct mail string to (pos, size, color), return counts of parsed, added, filtered and skipped comments"""
+        ...
+
+    def add_niconico_file(self, filename: str, mail_style: Callable[[str], Tuple[int, float, int]]) -> Dict[str, int]:
+        """same as add_niconico_stream but read the stream from a file"""
+        ...
+
+    def add_bilibili_reader(self, fp: BinaryIO) -> Dict[str, int]:
+        """same as add_bilibili_segment but read the segment from a binary file object block by block,
+        e.g. a gzip.GzipFile decompressing it on the fly"""
+        ...
+
+    def add_niconico_reader(self, fp: BinaryIO, mail_style: Callable[[str], Tuple[int, float, int]]) -> Dict[str, int]:
+        """same as add_niconico_stream but read the stream from a binary file object block by block"""
+        ...
+
     def to_string(self) -> str:
         """return the ass text"""
         ...
 
     def write_to_file(self, str) -> None:
         """direct write to the file to avoid memory cost"""
+        ...
+
+    def render(self, width: int, height: int) -> str:
+        """return the ass text laid out for another stage size, parsed comments are reused"""
+        ...
+
+    def to_strings(self, sizes: Sequence[Tuple[int, int]]) -> List[str]:
+        """return the ass text of each stage size"""
+        ...
+
+    def render_to_file(self, width: int, height: int, out_filename: str) -> None:
+        """same as render but write to the file"""
+        ...
+
+    def flush(self, final: bool = False) -> str:
+        """return the Dialogue lines of the comments added since the last flush, laid out against the rows
+        of the flushed ones, final also flushes the comments held back by reorder_window"""
+        ...
+
+    def to_buffer(self) -> "AssBuffer":
+        """return the ass text as UTF-8 in one preallocated buffer, use memoryview or bytes on it"""
+        ...
+
+    def iter_chunks(self, chunk_size: int = 65536, width: int = 0, height: int = 0) -> "AssChunkIterator":
+        """yield the ass text as UTF-8 blocks of at least chunk_size bytes (except the last one) while
+        comments are laid out, at another stage size if width and height are given (as render does),
+        no comment may be added before the iteration ends"""
+        ...
+
+class AssBuffer:
+    """read-only buffer of the ass text, supports the buffer protocol"""
+    def __len__(self) -> int: ...
+
+class AssChunkIterator(Iterator[bytes]):
+    def __next__(self) -> bytes: ...
@@ -0,0 +1,138 @@
+import glob
+import hashlib
+import json
+import os
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from danmakuC.__version__ import __version__
+from danmakuC.convert import convert, is_comment_file, strip_compressed_suffix
+from danmakuC.output import size_filename
+
+__all__ = ['find_inputs', 'batch_convert']
+
+MANIFEST_NAME = ".danmakuC-manifest.json"
+
+
+def find_inputs(sources: Iterable[Union[str, os.PathLike]]) -> List[Tuple[str, str]]:
+    """expand directories (recursively) and glob patterns to (file, path relative to its source root),
+    only files with comment extensions (.bin, .xml, .json..., optionally compressed) are taken from directories"""
+    inputs = []
+    for source in sources:
+        source = os.fspath(source)
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for name in sorted(files):
+                    if not is_comment_file(name):
+                        continue
+                    file = os.path.join(root, name)
+                    inputs.append((file, os.path.relpath(file, source)))
+        else:
+            files = sorted(f for f in glob.glob(source, recursive=True) if os.path.isfile(f))
+            if files:
+                base = os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in files])
+                inputs.extend((f, os.path.relpath(os.path.abspath(f), base)) for f in files)
+    return inputs
+
+
+def output_stem(rel: str) -> str:
+    """a/b.json.gz -> a/b"""
+    return os.path.splitext(strip_compressed_suffix(rel))[0]
+
+
+def file_hash(file: Union[str, os.PathLike]) -> str:
+    h = hashlib.sha256()
+    with open(file, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_manifest(path: str) -> Dict[str, dict]:
+    try:
+        with open(path, encoding='utf8') as f:
+            return json.load(f)["files"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def save_manifest(path: str, files: Dict[str, dict]):
+    tmp = path + ".tmp"
+    with open(tmp, 'w', encoding='utf8') as f:
+        json.dump({"version": __version__, "files": files}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def _convert_job(file: str, out_filename: str, params: dict, previous: Optional[dict]) -> Tuple[dict, bool]:
+    """convert one file in a worker process, return its manifest entry and whether it was converted"""
+    if os.path.getsize(file) == 0:
+        raise ValueError("empty comment file")
+    entry = {"sha256": file_hash(file), "params": params, "output": out_filename, "version": __version__}
+    sizes = params.get("sizes")
+    outputs = [size_filename(out_filename, w, h) for w, h in sizes] if sizes else [out_filename]
+    if previous == entry and all(os.path.exists(output) for output in outputs):
+        return entry, False
+    os.makedirs(os.path.dirname(out_filename) or ".", exist_ok=True)
+    convert(file, out_filename=out_filename, **params)
+    return entry, True
+
+
+def batch_convert(
+        sources: Iterable[Union[str, os.PathLike]],
+        output_dir: Union[str, os.PathLike],
+        max_workers: Optional[int] = None,
+        force: bool = False,
+        manifest: Optional[str] = None,
+        **params,
+) -> Dict[str, List[str]]:
+    """convert every comment file found in directories or glob patterns `sources` to `output_dir`
+    on a process pool, params are passed to the converters (width, height, font_face...)
+
+    A manifest of input content hashes and conversion params is kept in `output_dir`, files that
+    are unchanged since their last conversion are skipped unless force is True.
+    Raise ValueError if two inputs would be written to the same output file.
+    Return the input files that were converted, skipped and failed.
+    """
+    output_dir = os.fspath(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = manifest or os.path.join(output_dir, MANIFEST_NAME)
+    entries = {} if force else load_manifest(manifest)
+    # json round trip so params compare equal to the ones read back from the manifest
+    params = json.loads(json.dumps(params))
+    result = {"converted": [], "skipped": [], "failed": []}
+    inputs = find_inputs(sources)
+    # a.xml -> a.ass, but a.xml and a.json.gz -> a.xml.ass and a.json.ass
+    stems = Counter(output_stem(rel) for file, rel in inputs)
+    jobs = {}
+    for file, rel in inputs:
+        stem = output_stem(rel)
+        out_filename = os.path.join(output_dir, (stem if stems[stem] == 1 else strip_compressed_suffix(rel)) + ".ass")
+        jobs.setdefault(out_filename, []).append(file)
+    # the same relative path under two sources, or a.json and a.json.gz
+    collisions = {out: files for out, files in jobs.items() if len(files) > 1}
+    if collisions:
+        raise ValueError("several inputs map to the same output: " +
+                         "; ".join(f"{', '.join(files)} -> {out}" for out, files in collisions.items()))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for out_filename, (file,) in jobs.items():
+            key = os.path.abspath(file)
+            futures[executor.submit(_convert_job, file, out_filename, params, entries.get(key))] = key
+        try:
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    entry, converted = future.result()
+                except Exception as e:
+                    entries.pop(key, None)
+                    result["failed"].append(key)
+                    print(f"failed to convert {key}: {e!r}", file=sys.stderr)
+                    continue
+                entries[key] = entry
+                result["converted" if converted else "skipped"].append(key)
+        finally:
+            save_manifest(manifest, entries)
+    return result
@@ -1,8 +1,12 @@
 import json
 from google.protobuf.json_format import MessageToJson
 from .ass import Ass
-from .protobuf.bilibili import BiliCommentProto, BiliViewProto
-from typing import Union, Optional
+from .compression import decompressed, detect_compression
+from .output import OutputTarget, write_output
+from .profile import PhaseTimer, record_stats
+from .protobuf.bilibili import BiliViewProto
+from .protobuf.bilibili.reply_pb2 import DanmakuElem
+from typing import Union, Optional, Sequence, Tuple, List
 import io
 
 __all__ = ['proto2ass', 'parse_view']
@@ -18,41 +22,53 @@ def proto2ass(
         alpha: float = 1.0,
         duration_marquee: float = 5.0,
         duration_still: float = 5.0,
-        comment_filter: str = "",
+        comment_filter: Union[str, Sequence[str]] = "",
         reduced: bool = False,
         bold: bool = False,
         live: bool = False,
-        out_filename: str = "",
-) -> Optional[str]:
+        out_filename: Optional[OutputTarget] = "",
+        stats: Optional[dict] = None,
+        sizes: Optional[Sequence[Tuple[int, int]]] = None,
+        compress: Optional[bool] = None,
+        merge_window: float = 0.0,
+        merge_style: str = "count",
+        max_per_second: int = 0,
+        max_on_screen: int = 0,
+) -> Union[None, str, List[str]]:
+    timer = PhaseTimer()
     ass = Ass(width, height, reserve_blank, font_face, font_size, alpha, duration_marquee,
               duration_still, comment_filter, reduced, bold, live)
+    ass.merge_window, ass.merge_style = merge_window, merge_style
+    ass.max_per_second, ass.max_on_screen = max_per_second, max_on_screen
 
+    # DmSegMobileReply is decoded natively, elems with unsupported mode or overflowing fields are skipped.
+    # Files and compressed data are decoded while they are read (and decompressed)
     if isinstance(proto_file, io.IOBase):
-        proto_file = proto_file.read()
-    target = BiliCommentProto()
-    target.ParseFromString(proto_file)
-    # elem.mode > 8, example: https://www.bilibili.com/video/BV1Js411f78P/
-    mode_map = {1: 0, 4: 2, 5: 1, 6: 3, 7: 4}
-    for elem in target.elems:
-        if elem.mode not in mode_map:
-            continue
-        try:
-            ass.add_comment(
-                elem.progress / 1000,  # 视频内出现的时间
-                elem.ctime,  # 弹幕的发送时间（时间戳）
-                elem.content,
-                elem.fontsize / 25.0,
-                mode_map[elem.mode],
-                elem.color,
-                elem.pool
-            )
-        except TypeError:
-            # TypeError: incase integer overflow https://github.com/HFrost0/bilix/issues/102
-            continue
-    if out_filename:
-        return ass.write_to_file(out_filename)
+        ass.add_bilibili_reader(decompressed(proto_file))
+    elif detect_compression(proto_file[:2]):
+        ass.add_bilibili_reader(decompressed(io.BytesIO(proto_file)))
     else:
-        return ass.to_string()
+        ass.add_bilibili_segment(proto_file)
+    timer.lap("comments")
+    result = write_output(ass, out_filename, sizes, compress)
+    timer.lap("output")
+    record_stats(stats, ass, timer)
+    return result
+
+
+# DanmakuElem.mode to ass mode, same as convert_bili_mode of the native decoder
+MODE_MAP = {1: 0, 4: 2, 5: 1, 6: 3, 7: 4}
+
+
+def add_elem(ass: Ass, elem: Union[dict, DanmakuElem]) -> bool:
+    """add one DanmakuElem, or a dict with its field names, to `ass`, return True if it was added"""
+    get = elem.get if isinstance(elem, dict) else lambda key, default: getattr(elem, key, default)
+    mode, ctime, color = get("mode", 1), get("ctime", 0), get("color", 0xFFFFFF)
+    # the same elems are skipped as by the native decoder
+    if mode not in MODE_MAP or not -2 ** 31 <= ctime < 2 ** 31 or color >= 2 ** 31:
+        return False
+    return ass.add_comment(get("progress", 0) / 1000, ctime, get("content", ""), get("fontsize", 25) / 25,
+                           MODE_MAP[mode], color, get("pool", 0), get("weight", 0), get("attr", 0))
 
 
 def parse_view(content: bytes) -> dict:
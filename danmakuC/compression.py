@@ -0,0 +1,108 @@
+import gzip
+import io
+import os
+import zlib
+from typing import BinaryIO, Optional, Union
+
+__all__ = ['detect_compression', 'is_compressed_file', 'decompressed', 'open_input']
+
+GZIP_MAGIC = b'\x1f\x8b'
+CHUNK_SIZE = 1 << 20
+
+
+def detect_compression(head: bytes) -> Optional[str]:
+    """"gzip" or "zlib" if `head` (the first two bytes of a file at least) starts a compressed stream"""
+    if head[:2] == GZIP_MAGIC:
+        return "gzip"
+    # zlib header: deflate method and a check value making the first two bytes a multiple of 31
+    if len(head) >= 2 and head[0] & 0x0F == 8 and head[0] >> 4 <= 7 and (head[0] << 8 | head[1]) % 31 == 0:
+        return "zlib"
+    return None
+
+
+def is_compressed_file(filename: Union[str, os.PathLike]) -> bool:
+    with open(filename, 'rb') as fp:
+        return detect_compression(fp.read(2)) is not None
+
+
+class _PrefixedReader(io.RawIOBase):
+    """bytes already read from a file followed by the rest of the file"""
+
+    def __init__(self, prefix: bytes, fp: BinaryIO):
+        self.prefix = prefix
+        self.fp = fp
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if self.prefix:
+            n = min(len(b), len(self.prefix))
+            b[:n] = self.prefix[:n]
+            self.prefix = self.prefix[n:]
+            return n
+        data = self.fp.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+class ZlibReader(io.RawIOBase):
+    """decompress a zlib stream while it is read, at most CHUNK_SIZE bytes are inflated at a time"""
+
+    def __init__(self, fp: BinaryIO, close_fp: bool = False):
+        self.fp = fp
+        self.close_fp = close_fp
+        self.decompressor = zlib.decompressobj()
+        self.pending = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self.pending:
+            if self.decompressor.eof:
+                return 0
+            data = self.decompressor.unconsumed_tail or self.fp.read(CHUNK_SIZE)
+            if not data:
+                raise EOFError("compressed stream ended before the end-of-stream marker was reached")
+            self.pending = self.decompressor.decompress(data, CHUNK_SIZE)
+        n = min(len(b), len(self.pending))
+        b[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+    def close(self):
+        if self.close_fp and not self.closed:
+            self.fp.close()
+        super().close()
+
+
+def decompressed(fp: BinaryIO) -> BinaryIO:
+    """return a file object that reads `fp` decompressed if it is gzip or zlib compressed, otherwise `fp`
+    itself (or an equivalent reader when `fp` can not peek), data is decompressed while it is read"""
+    if isinstance(fp, io.TextIOBase):
+        return fp
+    if hasattr(fp, "peek"):
+        head = fp.peek(2)[:2]
+        source = fp
+    else:
+        head = fp.read(2)
+        source = io.BufferedReader(_PrefixedReader(head, fp), CHUNK_SIZE)
+    compression = detect_compression(head)
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=source, mode='rb')
+    if compression == "zlib":
+        return io.BufferedReader(ZlibReader(source), CHUNK_SIZE)
+    return source
+
+
+def open_input(file: Union[str, os.PathLike]) -> BinaryIO:
+    """open a comment file for binary reading, decompressing it transparently"""
+    fp = open(file, 'rb')
+    compression = detect_compression(fp.peek(2)[:2])
+    if compression == "gzip":
+        fp.close()
+        return gzip.open(file, 'rb')
+    if compression == "zlib":
+        return io.BufferedReader(ZlibReader(fp, close_fp=True), CHUNK_SIZE)
+    return fp
@@ -0,0 +1,77 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Mapping, Optional, Union
+
+from danmakuC import bilibili, niconico
+from danmakuC.compression import open_input
+
+__all__ = ['get_convert_func', 'convert', 'convert_many']
+
+COMPRESSED_SUFFIXES = (".gz", ".zz", ".zlib")
+# extensions of the comment files found in directories by batch conversion, optionally compressed
+COMMENT_SUFFIXES = (".bin", ".pb", ".xml", ".json")
+
+
+def strip_compressed_suffix(name: str) -> str:
+    """dm.json.gz -> dm.json"""
+    for suffix in COMPRESSED_SUFFIXES:
+        if name.lower().endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def is_comment_file(name: str) -> bool:
+    return strip_compressed_suffix(name).lower().endswith(COMMENT_SUFFIXES)
+
+
+def get_convert_func(file: Union[str, os.PathLike], ) -> Callable:
+    # dm.json.gz is detected as dm.json
+    name = strip_compressed_suffix(os.fspath(file).lower())
+    ext = name.split('.')[-1]
+    with open_input(file) as fp:
+        head = fp.read(128)
+    if ext == "json":
+        return niconico.json2ass
+    if ext == "xml":
+        if b"packet" in head:
+            return niconico.xml2ass
+        # else:
+        #     return bilibili.xml2ass
+    firstbyte = head[:1]
+    if firstbyte == b'\x0a':
+        convert_func = bilibili.proto2ass
+    else:
+        convert_func = niconico.proto2ass
+    return convert_func
+
+
+def convert(file: Union[str, os.PathLike], width: int = 1920, height: int = 1080, **kwargs) -> Optional[str]:
+    """convert a comment file with the converter detected by get_convert_func, keyword arguments are passed
+    to the converter, return the ass text or None if out_filename is given. Compressed files are
+    decompressed while they are converted"""
+    with open(file, 'rb') as f:
+        return get_convert_func(file)(f, width, height, **kwargs)
+
+
+def convert_many(
+        jobs: Iterable[Union[str, os.PathLike, Mapping]],
+        max_workers: Optional[int] = None,
+        return_exceptions: bool = False,
+) -> List[Union[Optional[str], BaseException]]:
+    """run conversions on a thread pool and return their results in order
+
+    Each job is a comment file path or a mapping of `convert` keyword arguments including "file".
+    The native parts of a conversion release the GIL, so the conversions run in parallel.
+    If return_exceptions is True, a failed job returns its exception instead of raising it.
+    """
+    def run(job):
+        kwargs = {"file": job} if isinstance(job, (str, os.PathLike)) else dict(job)
+        try:
+            return convert(**kwargs)
+        except Exception as e:
+            if return_exceptions:
+                return e
+            raise
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(run, jobs))
@@ -0,0 +1,65 @@
+#pragma once
+#include <cstdint>
+#include <stdexcept>
+#include <string>
+#include <string_view>
+#include <unordered_map>
+#include <vector>
+
+
+// Compact storage of comment strings. Texts are appended to one contiguous arena and
+// referenced by offset and size instead of one heap string per comment, and the few
+// distinct font names are interned so that a comment only keeps a small index.
+
+struct TextRef {
+    uint64_t offset = 0;
+    uint32_t size = 0;
+};
+
+class TextArena {
+public:
+    TextRef add(std::string_view text) {
+        TextRef ref{data.size(), uint32_t(text.size())};
+        data.append(text.data(), text.size());
+        return ref;
+    }
+
+    std::string_view view(TextRef ref) const {
+        return std::string_view(data.data() + ref.offset, ref.size);
+    }
+
+    size_t capacity() const {
+        return data.capacity();
+    }
+
+private:
+    std::string data;
+};
+
+class FontTable {
+public:
+    // index of `name`, equal names share an index
+    uint16_t intern(const std::string& name) {
+        auto it = ids.find(name);
+        if (it != ids.end())
+            return it->second;
+        if (names.size() > UINT16_MAX)
+            throw std::length_error("too many distinct fonts");
+        uint16_t id = uint16_t(names.size());
+        names.push_back(name);
+        ids.emplace(name, id);
+        return id;
+    }
+
+    const std::string& name(uint16_t id) const {
+        return names[id];
+    }
+
+    size_t size() const {
+        return names.size();
+    }
+
+private:
+    std::vector<std::string> names;
+    std::unordered_map<std::string, uint16_t> ids;
+};
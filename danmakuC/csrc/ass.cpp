@@ -1,26 +1,39 @@
 #include <map>
 #include <cmath>
-#include <codecvt>
-#include <regex>
+#include <climits>
+#include <limits>
+#include <memory>
+#include <iterator>
 #include <fstream>
+#include <tuple>
+#include <functional>
 #include <fmt/core.h>
 #include <pybind11/pybind11.h>
+#include <pybind11/stl.h>
+#include <pybind11/functional.h>
 #include <boost/algorithm/string.hpp>
+#include "filter.hpp"
+#include "rows.hpp"
+#include "wire.hpp"
+#include "text.hpp"
+#include "stats.hpp"
+#include "arena.hpp"
+#include "density.hpp"
+#include "parallel.hpp"
 
 
 using namespace std;
 
 
+// One stored comment. Millions of them are kept until output, so the text lives in the
+// TextArena of the Ass and the font is an index into its FontTable.
 class Comment {
 public:
+    TextRef content;
     float progress;
     float duration;
     int ctime;
-    string content;
-    int mode;
-    int pool;
     // override tags
-    string font;
     float size;
     int color;
     float alpha;
@@ -30,27 +43,67 @@ public:
     float max_len;
     int row;
     int lines = 1;
-    int align = 0;
     float delta_l = 0;
+    uint32_t repeats = 1;  // comments merged into this one, see Ass::merge_repeats
+    // priority for the density cap
+    uint8_t weight = 0;
+    bool liked = false;
+    // stage independent values, fit_stage derives the values above from them for each stage size
+    float base_progress;
+    float base_duration;
+    float base_size;
+    float base_part_size;
+    float base_max_len;
+    uint16_t font;
+    int8_t mode;
+    int8_t pool;
+    int8_t align = 0;
+    bool nico = false;
+    bool full = false;
+    bool ender = false;
 
     Comment() = delete;
 
     Comment(float progress,
             float duration,
             int ctime,
-            string content,
+            TextRef content,
             int mode,
             int pool,
 
-            string font,
+            uint16_t font,
             float size,
             int color,
             float alpha
-    ) : progress(progress), duration(duration), ctime(ctime), content(content), mode(mode), pool(pool),
-        font(font), size(size), color(color), alpha(alpha) {
+    ) : content(content), progress(progress), duration(duration), ctime(ctime), size(size), color(color), alpha(alpha),
+        font(font), mode(int8_t(mode)), pool(int8_t(pool)) {
             vpos = progress;
         }
 
+    void save_base() {
+        base_progress = progress;
+        base_duration = duration;
+        base_size = size;
+        base_part_size = part_size;
+        base_max_len = max_len;
+    }
+
+    // reset the stage dependent values, then resize and retime niconico comments for the stage
+    void fit_stage(int width, int height, float dm) {
+        progress = base_progress;
+        duration = base_duration;
+        size = base_size;
+        part_size = base_part_size;
+        max_len = base_max_len;
+        align = 0;
+        delta_l = 0;
+        if (nico) {
+            resize(height, full, ender);
+            if (mode == 0 || mode == 3)
+                retime(width, height, dm);
+        }
+    }
+
     // https://w.atwiki.jp/commentart2/pages/31.html
     void resize(int height, bool full, bool ender) {
         int width = full ? height * 16.0/9.0 : height * 4.0/3.0;
@@ -128,49 +181,101 @@ public:
     }
 };
 
-size_t utf8_len(const string& utf8) {
-    return wstring_convert<codecvt_utf8<char32_t>, char32_t>{}.from_bytes(utf8).size();
+
+// " ×N" appended to comments merged with merge_style "count"
+string repeat_marker(uint32_t repeats) {
+    return fmt::format(" \xc3\x97{}", repeats);
+}
+
+// content, mode and pool of a comment, comments with the same key are merged
+struct MergeKey {
+    string_view text;
+    int stage;
+
+    bool operator==(const MergeKey& o) const {
+        return stage == o.stage && text == o.text;
+    }
+};
+
+struct MergeKeyHash {
+    size_t operator()(const MergeKey& k) const {
+        return hash<string_view>()(k.text) * 31 + k.stage;
+    }
+};
+
+// the override tags after the position of a Dialogue only depend on these, so they are built
+// once per distinct key while serializing
+struct TagKey {
+    uint16_t font;
+    int color;
+    float size;
+    float alpha;
+
+    bool operator==(const TagKey& o) const {
+        return font == o.font && color == o.color && size == o.size && alpha == o.alpha;
+    }
+};
+
+struct TagKeyHash {
+    size_t operator()(const TagKey& k) const {
+        return ((hash<float>()(k.size) * 31 + hash<float>()(k.alpha)) * 31 + k.color) * 31 + k.font;
+    }
+};
+
+using TagCache = unordered_map<TagKey, string, TagKeyHash>;
+
+// comments formatted by a serialization worker at a time, see Ass::continue_layout
+constexpr size_t SERIALIZE_CHUNK = 16384;
+
+// Comment::row of a comment dropped by the layout
+constexpr int DROPPED_ROW = INT_MIN;
+
+bool is_still(int mode) {
+    return mode == 1 || mode == 2;
 }
 
-int find_alternative_row(vector<vector<Comment*>>& rows, Comment& c, int height, int reserve_blank) {
-    int res = 0;
-    for (int row = 0; row < height - reserve_blank - ceil(c.part_size); ++row) {
-        if (rows[c.mode][row] == nullptr)
-            return row;
-        else if (rows[c.mode][row]->progress < rows[c.mode][res]->progress)
-            res = row;
+// keys of `c` as the occupant of its rows, see test_free_row for how they are compared
+RowOccupant row_occupant(Comment& c, int width) {
+    RowOccupant o;
+    o.progress = c.progress;
+    if (is_still(c.mode))
+        o.key1 = c.progress + c.duration - 0.1;
+    else {
+        int div = c.max_len + width;
+        if (div != 0) {
+            o.key1 = c.progress;
+            o.key2 = c.progress + c.max_len * c.duration / div;
+        }
     }
-    return res;
+    return o;
 }
 
-void mark_comment_row(vector<vector<Comment*>>& rows, Comment& c, int row) {
-    for (size_t i = row; i < row + ceil(c.part_size) && i < rows[0].size(); ++i)
-        rows[c.mode][i] = &c;
+int find_alternative_row(RowIndex& rows, Comment& c, int height, int reserve_blank) {
+    double end = height - reserve_blank - ceil(c.part_size);
+    if (end <= 0)
+        return 0;
+    int row_end = min(int(ceil(end)), rows.size());
+    int row = rows.first_empty(row_end);
+    if (row >= 0)
+        return row;
+    return rows.first_min_progress(row_end);
 }
 
-void unmark_rows(vector<vector<Comment*>>& rows, int mode) {
-    for (size_t i = 0; i < rows[mode].size(); ++i)
-        rows[mode][i] = nullptr;
+void mark_comment_row(RowIndex& rows, Comment& c, int row, int width) {
+    rows.assign(row, min(row + int(ceil(c.part_size)), rows.size()), row_occupant(c, width));
 }
 
-int test_free_row(vector<vector<Comment*>>& rows, Comment& c, int row, int width, int height, int reserve_blank) {
-    int res = 0;
-    int row_max = height - reserve_blank;
-    Comment* target_row = nullptr;
-    if (c.mode == 1 || c.mode == 2) {
-        while (row < row_max && res < c.part_size) {
-            if (target_row != rows[c.mode][row]) {
-                target_row = rows[c.mode][row];
-                // Niconico appears to allow a slight overlap for still comments
-                // Example: https://www.nicovideo.jp/watch/sm31436903
-                // Refer to 2:18 ~ 2:21, comment no.415 ("に") and no.433 ("に"), vpos: 138.80s and 141.71s, duration: 3.0s
-                // Set the tolerance to 0.1s for now
-                if (target_row != nullptr && target_row->progress + target_row->duration - 0.1 > c.progress)
-                    break;
-            }
-            row++;
-            res++;
-        }
+// return the first row in [0, row_max] where `c` has enough free rows, -1 if there is none
+int test_free_row(RowIndex& rows, Comment& c, int row_max, int width) {
+    double x1, x2;
+    if (is_still(c.mode)) {
+        // Niconico appears to allow a slight overlap for still comments
+        // Example: https://www.nicovideo.jp/watch/sm31436903
+        // Refer to 2:18 ~ 2:21, comment no.415 ("に") and no.433 ("に"), vpos: 138.80s and 141.71s, duration: 3.0s
+        // Set the tolerance to 0.1s for now
+        // blocked if target->progress + target->duration - 0.1 > c.progress
+        x1 = c.progress;
+        x2 = INFINITY;
     } else {
         int div = c.max_len + width;
         float threshold_time;
@@ -178,21 +283,12 @@ int test_free_row(vector<vector<Comment*>>& rows, Comment& c, int row, int width
             threshold_time = c.progress - c.duration * (1 - width / float(div));
         else
             threshold_time = c.progress - c.duration;
-        while (row < row_max && res < c.part_size) {
-            if (target_row != rows[c.mode][row]) {
-                target_row = rows[c.mode][row];
-                if (target_row != nullptr) {
-                    div = target_row->max_len + width;
-                    if (div != 0 && (target_row->progress > threshold_time ||
-                                    target_row->progress + target_row->max_len * target_row->duration / div > c.progress))
-                        break;
-                }
-            }
-            row++;
-            res++;
-        }
+        // blocked if target->progress > threshold_time ||
+        //            target->progress + target->max_len * target->duration / div > c.progress
+        x1 = threshold_time;
+        x2 = c.progress;
     }
-    return res;
+    return rows.find_free(row_max, max(int(ceil(c.part_size)), 0), x1, x2);
 }
 
 vector<float> get_zoom_factor(vector<int>& source_size, vector<int>& target_size) {
@@ -213,20 +309,6 @@ vector<float> get_zoom_factor(vector<int>& source_size, vector<int>& target_size
 }
 
 // https://aegi.vmoe.info/docs/3.0/ASS_Tags/#index1h2
-string ass_escape(string s) {
-    const string ZERO_WIDTH_SPACE = "\xe2\x80\x8b"; // U+200B
-
-    // prevent "\" from causing line breaks/escaping anything ("\\" won't work)
-    string s2 = boost::replace_all_copy(s, R"(\)", R"(\)" + ZERO_WIDTH_SPACE);
-
-    // escape "}" and "{" (override block chars) with backslash
-    s2 = std::regex_replace(s2, std::regex(R"(([}{]))"), R"(\$1)");
-
-    // preserve intended spacing at start and end of lines
-    boost::replace_all(s2, "\n", ZERO_WIDTH_SPACE + R"(\N)" + ZERO_WIDTH_SPACE);
-    return ZERO_WIDTH_SPACE + s2 + ZERO_WIDTH_SPACE;
-}
-
 string convert_color(int RGB) {
     if (RGB == 0x000000)
         return "000000";
@@ -258,6 +340,18 @@ int convert_type2(int row, int height, int reserve_blank) {
     return height - reserve_blank - row;
 }
 
+// bilibili DanmakuElem.mode to ass mode, -1 for unsupported modes
+int convert_bili_mode(int mode) {
+    switch (mode) {
+        case 1: return 0;
+        case 4: return 2;
+        case 5: return 1;
+        case 6: return 3;
+        case 7: return 4;
+        default: return -1;
+    }
+}
+
 class Ass {
 public:
     int width;
@@ -268,12 +362,37 @@ public:
     float alpha;
     float duration_marquee;
     float duration_still;
-    string filter;
+    CommentFilter filter;
+    TextWidthCache widths;
+    string text_buffer;
+    AssStats stats;
     bool reduced;
     bool bold;
     bool live;
     // others
     vector<Comment> comments;
+    // state of the incremental layout, see flush
+    float reorder_window = 0;
+    vector<vector<RowIndex>> live_rows;
+    vector<uint32_t> live_pending;
+    size_t live_next = 0;
+    float live_latest = -INFINITY;
+    float live_frontier = -INFINITY;
+    TagCache live_tags;
+    TextArena texts;
+    FontTable font_table;  // font_face is font 0
+    vector<uint32_t> order;  // comments sorted by (vpos, ctime), rebuilt when comments are added
+    // repeated comments within merge_window seconds are laid out once, shown with a " ×N"
+    // marker (merge_style "count"), a larger font ("scale") or as is ("none"), 0 disables it
+    float merge_window = 0;
+    string merge_style = "count";
+    // at most max_per_second comments starting in a second and max_on_screen comments shown at
+    // once on each (pool, mode) stage, the ones with the lowest priority are dropped, 0 disables it
+    int max_per_second = 0;
+    int max_on_screen = 0;
+    // threads of the layout and serialization, 0 is one per core
+    int workers = 0;
+    vector<uint32_t> selected;  // order without the merged repeats and the comments over the density cap
     unordered_map<string, string> fonts;
     vector<string> keys = {"defont", "mincho", "gothic"};
     vector<int> bili_player_size;
@@ -283,15 +402,29 @@ public:
     bool need_clear = false;
 
     Ass(int w, int h, int rb, const string& ff, float fs, float a, float dm, float ds, const string& flt, bool rd, bool b, bool lv) :
+            Ass(w, h, rb, ff, fs, a, dm, ds, vector<string>{flt}, rd, b, lv) {}
+
+    Ass(int w, int h, int rb, const string& ff, float fs, float a, float dm, float ds, const vector<string>& flts, bool rd, bool b, bool lv) :
             width(w), height(h), reserve_blank(rb), font_face(ff), font_size(fs), alpha(a), duration_marquee(dm),
-            duration_still(ds), filter(flt), reduced(rd), bold(b), live(lv) {
+            duration_still(ds), reduced(rd), bold(b), live(lv) {
+        for (const string& flt: flts)
+            filter.add_pattern(flt);
         vector<string> fontlist;
         boost::split(fontlist, font_face, boost::is_any_of(","));
         font_face = fontlist[0];
+        font_table.intern(font_face);
         fontlist.resize(keys.size(), fontlist[0]);
         for (size_t i = 0; i < keys.size(); ++i) {
             fonts[keys[i]] = fontlist[i];
         }
+        set_stage(width, height);
+    }
+
+    // set the stage size used by the following output, comments are laid out again
+    void set_stage(int w, int h) {
+        width = w;
+        height = h;
+        need_clear = true;
         head = fmt::format("[Script Info]\n"
                            "; Script generated by danmakuC (based on Danmaku2ASS)\n"
                            "; https://github.com/HFrost0/danmakuC\n"
@@ -322,39 +455,38 @@ public:
         zoom_factor = get_zoom_factor(bili_player_size, target_size);
     }
 
-    bool add_comment(float progress, int ctime, const string& content, float size_factor, int mode, int color, int pool) {
+    // `weight` (0-10) and `attr` (bit 2: high-liked) of bilibili comments set their priority for the density cap
+    bool add_comment(float progress, int ctime, const string& content, float size_factor, int mode, int color, int pool,
+                     int weight = 0, int attr = 0) {
         // need clear
         need_clear = true;
-        // content regex filter
-        if (filter != "" && regex_search(content, regex(filter)))
+        // content filter
+        if (filter.match(content)) {
+            stats.filtered++;
             return false;
+        }
         
         float duration = (mode == 1 || mode == 2)? duration_still : duration_marquee;
-        Comment comment = Comment(progress, duration, ctime, content, mode, pool,
-                                font_face, font_size * size_factor, color, alpha);
-
-        // ASS renders typically ignore tab characters
-        const string FULL_WIDTH_SPACE = "\xe3\x80\x80"; // U+3000
-        boost::replace_all(comment.content, "\t", FULL_WIDTH_SPACE + FULL_WIDTH_SPACE);
+        // escape and measure the text in one pass, see normalize_text
+        TextMetrics text = normalize_text(content, text_buffer, widths);
+        Comment comment = Comment(progress, duration, ctime, texts.add(text_buffer), mode, pool,
+                                0, font_size * size_factor, color, alpha);
 
         // calculate extra filed
         if (comment.mode != 4) {
-            vector<string> parts;
-            boost::split(parts, comment.content, boost::is_any_of("\n"));
-            comment.lines = parts.size();
+            comment.lines = text.lines;
             comment.part_size = comment.size * comment.lines;
-            int max_len = 0;
-            for (string& p: parts) {
-                int part_len = utf8_len(p);
-                if (part_len > max_len)
-                    max_len = part_len;
-            }
-            comment.max_len = max_len * comment.size;
+            comment.max_len = text.max_width * comment.size;
         } else
             // bilipos comment
             comment.size = 25.0 * size_factor, comment.part_size = 0, comment.max_len = 0;
-        comment.content = ass_escape(comment.content);
+        comment.weight = uint8_t(max(0, min(weight, 255)));
+        comment.liked = attr & 4;
+        comment.save_base();
         comments.push_back(comment);
+        stats.added++;
+        stats.by_mode[mode]++;
+        stats.by_pool[pool]++;
         return true;
     }
 
@@ -362,162 +494,551 @@ public:
                         float alpha_factor, string font, int pool, bool full, bool ender) {
         // need clear
         need_clear = true;
-        // content regex filter
-        if (filter != "" && regex_search(content, regex(filter)))
+        // content filter
+        if (filter.match(content)) {
+            stats.filtered++;
             return false;
+        }
         
-        Comment comment = Comment(progress, duration, ctime, content, mode, pool,
-                                fonts[font], font_size * size_factor, color, log2(1 + alpha) * alpha_factor);
-        // ASS renders typically ignore tab characters
-        const string FULL_WIDTH_SPACE = "\xe3\x80\x80"; // U+3000
-        boost::replace_all(comment.content, "\t", FULL_WIDTH_SPACE + FULL_WIDTH_SPACE);
-
+        TextMetrics text = normalize_text(content, text_buffer, widths);
+        Comment comment = Comment(progress, duration, ctime, texts.add(text_buffer), mode, pool,
+                                font_table.intern(fonts[font]), font_size * size_factor, color, log2(1 + alpha) * alpha_factor);
         // calculate extra filed
-        vector<string> parts;
-        boost::split(parts, comment.content, boost::is_any_of("\n"));
-        comment.lines = parts.size();
+        comment.lines = text.lines;
         comment.part_size = comment.size * comment.lines;
-        int max_len = 0;
-        for (string& p: parts) {
-            int part_len = utf8_len(p);
-            if (part_len > max_len)
-                max_len = part_len;
-        }
-        comment.max_len = max_len * comment.size;
-        //resize
-        comment.resize(height, full, ender);
-        // retime
-        if (mode == 0 || mode == 3)
-            comment.retime(width, height, duration_marquee);
-        comment.content = ass_escape(comment.content);
+        comment.max_len = text.max_width * comment.size;
+        // resize and retime depend on the stage size, see Comment::fit_stage
+        comment.nico = true;
+        comment.full = full;
+        comment.ender = ender;
+        comment.save_base();
         comments.push_back(comment);
+        stats.added++;
+        stats.by_mode[mode]++;
+        stats.by_pool[pool]++;
         return true;
     }
 
+    // decode DmElem messages and add their comments
+    template <class Elems>
+    map<string, size_t> add_bilibili_elems(Elems& elems) {
+        ScopedTimer timer(stats.decode);
+        map<string, size_t> counts = {{"parsed", 0}, {"added", 0}, {"filtered", 0}, {"skipped", 0}};
+        string_view data;
+        while (elems.next(data)) {
+            int wire_type;
+            WireReader elem(data);
+            int32_t progress = 0, mode = 0, fontsize = 0, pool = 0, weight = 0, attr = 0;
+            uint32_t color = 0;
+            int64_t ctime = 0;
+            string_view content;
+            while (!elem.eof()) {
+                uint32_t f = elem.read_tag(wire_type);
+                if (wire_type == WIRE_VARINT) {
+                    uint64_t v = elem.read_varint();
+                    switch (f) {
+                        case 2: progress = int32_t(v); break;
+                        case 3: mode = int32_t(v); break;
+                        case 4: fontsize = int32_t(v); break;
+                        case 5: color = uint32_t(v); break;
+                        case 8: ctime = int64_t(v); break;
+                        case 9: weight = int32_t(v); break;
+                        case 11: pool = int32_t(v); break;
+                        case 13: attr = int32_t(v); break;
+                    }
+                } else if (f == 7 && wire_type == WIRE_LEN)
+                    content = elem.read_bytes();
+                else
+                    elem.skip(wire_type);
+            }
+            counts["parsed"]++;
+            // elem.mode > 8, example: https://www.bilibili.com/video/BV1Js411f78P/
+            int ass_mode = convert_bili_mode(mode);
+            // incase integer overflow https://github.com/HFrost0/bilix/issues/102
+            if (ass_mode < 0 || ctime < INT_MIN || ctime > INT_MAX || color > uint32_t(INT_MAX)) {
+                counts["skipped"]++;
+                continue;
+            }
+            if (add_comment(progress / 1000.0, ctime, string(content), fontsize / 25.0, ass_mode, color, pool, weight, attr))
+                counts["added"]++;
+            else
+                counts["filtered"]++;
+        }
+        return counts;
+    }
+
+    map<string, size_t> add_bilibili_segment(const char* data, size_t size) {
+        BufferFields elems(data, size, 1);  // DmSegMobileReply.elems
+        return add_bilibili_elems(elems);
+    }
+
+    // decode a length-prefixed NNDComment stream and add its comments, `mail_style` resolves
+    // a mail string to (pos, size, color) and is called once for each distinct mail string
+    template <class Frames>
+    map<string, size_t> add_niconico_frames(Frames& frames, const function<tuple<int, float, int>(const string&)>& mail_style) {
+        ScopedTimer timer(stats.decode);
+        map<string, size_t> counts = {{"parsed", 0}, {"added", 0}, {"filtered", 0}, {"skipped", 0}};
+        unordered_map<string, tuple<int, float, int>> styles;
+        string_view frame;
+        while (frames.next(frame)) {
+            WireReader comment(frame);
+            int32_t vpos = 0;
+            int64_t date = 0;
+            string_view mail, content, fork;
+            while (!comment.eof()) {
+                int wire_type;
+                uint32_t f = comment.read_tag(wire_type);
+                if (wire_type == WIRE_VARINT && (f == 3 || f == 4)) {
+                    uint64_t v = comment.read_varint();
+                    if (f == 3)
+                        vpos = int32_t(v);
+                    else
+                        date = int64_t(v);
+                } else if (wire_type == WIRE_LEN && (f == 8 || f == 12 || f == 15)) {
+                    string_view v = comment.read_bytes();
+                    if (f == 8)
+                        mail = v;
+                    else if (f == 12)
+                        content = v;
+                    else
+                        fork = v;
+                } else
+                    comment.skip(wire_type);
+            }
+            counts["parsed"]++;
+            if (date < INT_MIN || date > INT_MAX) {
+                counts["skipped"]++;
+                continue;
+            }
+            string mail_key(mail);
+            auto it = styles.find(mail_key);
+            if (it == styles.end())
+                it = styles.emplace(mail_key, mail_style(mail_key)).first;
+            auto [pos, size, color] = it->second;
+            int pool = fork == "owner" ? 1 : 0;
+            if (add_comment(vpos / 100.0, date, string(content), size, pos, color, pool))
+                counts["added"]++;
+            else
+                counts["filtered"]++;
+        }
+        return counts;
+    }
+
+    map<string, size_t> add_niconico_stream(const char* data, size_t size, const function<tuple<int, float, int>(const string&)>& mail_style) {
+        BufferFrames frames(data, size);
+        return add_niconico_frames(frames, mail_style);
+    }
+
+    map<string, size_t> add_niconico_file(const string& filename, const function<tuple<int, float, int>(const string&)>& mail_style) {
+        std::ifstream in_fp(filename, std::ifstream::in | std::ifstream::binary);
+        if (!in_fp)
+            throw std::invalid_argument(fmt::format("cannot open file: {}", filename));
+        StreamFrames<std::ifstream> frames(in_fp);
+        return add_niconico_frames(frames, mail_style);
+    }
+
+    // render the comments at another stage size without ingesting them again
+    string render(int w, int h) {
+        int old_width = width, old_height = height;
+        set_stage(w, h);
+        string res = serialize();
+        set_stage(old_width, old_height);
+        return res;
+    }
+
+    vector<string> to_strings(const vector<pair<int, int>>& sizes) {
+        vector<string> res;
+        for (auto [w, h]: sizes)
+            res.push_back(render(w, h));
+        return res;
+    }
+
+    void render_to_file(int w, int h, string out_filename) {
+        int old_width = width, old_height = height;
+        set_stage(w, h);
+        write_to_file(out_filename);
+        set_stage(old_width, old_height);
+    }
+
     string to_string() {
         if (body == "" || need_clear) {
-            write_comments();
+            body.clear();
+            write_comments(body);
         }
         return head + body;
     }
 
-    void write_comments(std::ofstream* out_fp = nullptr) {
-        /// 1. clear body first
-        body = "";
-        /// 2. sort before find row
-        stable_sort(comments.begin(), comments.end(), [](const Comment& a, const Comment& b) -> bool {
+    // head and comments serialized into one preallocated string, the body cache is not used
+    string serialize() {
+        string out;
+        out.reserve(head.size() + comments.size() * 80 + texts.capacity());
+        out += head;
+        write_comments(out);
+        return out;
+    }
+
+    void write_comments(string& out) {
+        Layout layout = start_layout();
+        continue_layout(layout, out, std::numeric_limits<size_t>::max());
+    }
+
+    // the next comment of an ongoing layout and the override tag caches of its writers, rows are
+    // assigned by start_layout
+    struct Layout {
+        size_t idx = 0;
+        vector<TagCache> tags;
+    };
+
+    size_t worker_threads() const {
+        return workers > 0 ? size_t(workers) : worker_count();
+    }
+
+    Layout start_layout() {
+        /// 1. fit comments to the stage and sort before find row
+        stats.reset_layout();
+        {
+            ScopedTimer timer(stats.sort);
+            for (Comment& c: comments)
+                c.fit_stage(width, height, duration_marquee);
+            if (order.size() != comments.size())
+                sort_comments();
+            merge_repeats();
+            limit_density();
+        }
+        assign_rows();
+        need_clear = false;
+        return Layout{0, vector<TagCache>(worker_threads())};
+    }
+
+    /// 2. find rows. A comment only collides with comments of its (pool, mode) stage, so every
+    // stage is laid out on its own thread, in the (vpos, ctime) order of layout_order
+    void assign_rows() {
+        ScopedTimer timer(stats.layout);
+        vector<vector<uint32_t>> stages(3 * 4);
+        for (uint32_t i: layout_order()) {
+            const Comment& c = comments[i];
+            if (c.mode != 4)  // bilipos
+                stages[c.pool * 4 + c.mode].push_back(i);
+        }
+        vector<AssStats> counters(stages.size());
+        auto run = [&](size_t k) {
+            RowIndex stage_rows(height - reserve_blank + 1);
+            for (uint32_t i: stages[k])
+                place_comment(stage_rows, comments[i], counters[k]);
+        };
+        vector<size_t> busy;
+        for (size_t k = 0; k < stages.size(); ++k)
+            if (!stages[k].empty())
+                busy.push_back(k);
+        if (busy.size() > 1 && comments.size() >= 4096 && worker_threads() > 1)
+            run_parallel(busy.size(), [&](size_t j) { run(busy[j]); });
+        else
+            for (size_t k: busy)
+                run(k);
+        for (const AssStats& n: counters)
+            stats.add_row_counters(n);
+    }
+
+    // sort a compact key array instead of moving the comments, ties keep the insertion order
+    void sort_comments() {
+        struct SortKey {
+            float vpos;
+            int ctime;
+            uint32_t idx;
+        };
+        vector<SortKey> keys;
+        keys.reserve(comments.size());
+        for (size_t i = 0; i < comments.size(); ++i)
+            keys.push_back({comments[i].vpos, comments[i].ctime, uint32_t(i)});
+        sort(keys.begin(), keys.end(), [](const SortKey& a, const SortKey& b) {
             if (a.vpos != b.vpos)
                 return a.vpos < b.vpos;
-            else
+            if (a.ctime != b.ctime)
                 return a.ctime < b.ctime;
+            return a.idx < b.idx;
         });
-        /// 3. find row
-        vector<vector<vector<Comment*>>> rows(3, vector<vector<Comment*>>(4, vector<Comment*>(height - reserve_blank + 1, nullptr)));
-        for (size_t idx = 0; idx < comments.size(); ++idx) {
-            Comment& c = comments[idx];
-            if (c.mode != 4) {  // not a bilipos
-                int row = 0;
-                int row_max = height - reserve_blank - c.part_size;
-                // Keep the row value fixed if the partsize exceeds stage height
-                // https://w.atwiki.jp/commentart2/pages/31.html ③高さ固定
-                if (row_max <= 0) {
-                    if (c.mode == 0 || c.mode == 3) {
-                        c.row = (height - reserve_blank) / 2;
-                        c.align = 4;
-                    } else
-                        c.row = 0;
-                }
-                else {
-                    bool flag = true;
-                    while (row <= row_max) {
-                        int free_row = test_free_row(rows[c.pool], c, row,
-                                                    width, height, reserve_blank);
-                        if (free_row >= c.part_size) {
-                            mark_comment_row(rows[c.pool], c, row);
-                            flag = false;
-                            break;
-                        } else
-                            row += free_row || 1; // todo condition is always true?
-                    }
-                    if (flag) {
-                        if (reduced) continue;
-                        row = find_alternative_row(rows[c.pool], c, height, reserve_blank);
-                        if (row == 0)
-                            unmark_rows(rows[c.pool], c.mode);
-                        mark_comment_row(rows[c.pool], c, row);
-                    }
-                    c.row = row;
-                }
-                write_comment(c, out_fp);
+        order.resize(keys.size());
+        for (size_t i = 0; i < keys.size(); ++i)
+            order[i] = keys[i].idx;
+    }
+
+    // fold each comment repeating the content of an earlier one on the same (pool, mode) stage
+    // within merge_window seconds of it into that one, then apply merge_style to the kept ones
+    void merge_repeats() {
+        for (Comment& c: comments)
+            c.repeats = 1;
+        selected.clear();
+        if (merge_window <= 0)
+            return;
+        struct Group {
+            uint32_t idx;
+            float start;
+        };
+        unordered_map<MergeKey, Group, MergeKeyHash> groups;
+        selected.reserve(order.size());
+        for (uint32_t i: order) {
+            Comment& c = comments[i];
+            if (c.mode == 4) {
+                selected.push_back(i);
+                continue;
+            }
+            auto [it, inserted] = groups.try_emplace(MergeKey{texts.view(c.content), c.pool * 8 + c.mode}, Group{i, c.vpos});
+            if (!inserted && c.vpos - it->second.start < merge_window) {
+                comments[it->second.idx].repeats++;
+                stats.merged++;
+                continue;
+            }
+            it->second = Group{i, c.vpos};
+            selected.push_back(i);
+        }
+        for (uint32_t i: selected) {
+            Comment& c = comments[i];
+            if (c.repeats == 1)
+                continue;
+            if (merge_style == "scale") {
+                float r = min(1 + log10(float(c.repeats)) / 2, 2.0f);
+                c.size *= r;
+                c.part_size *= r;
+                c.max_len *= r;
+            } else if (merge_style == "count")
+                c.max_len += text_width(repeat_marker(c.repeats)) * c.size;
+        }
+    }
+
+    // drop the comments over max_per_second or max_on_screen, see limit_density
+    void limit_density() {
+        if (max_per_second <= 0 && max_on_screen <= 0)
+            return;
+        const vector<uint32_t>& candidates = merge_window > 0 ? selected : order;
+        vector<DensityItem> items;
+        items.reserve(candidates.size());
+        for (uint32_t i: candidates) {
+            const Comment& c = comments[i];
+            items.push_back({c.pool * 8 + c.mode, c.progress, c.progress + c.duration,
+                             comment_priority(c.liked, c.weight, c.content.size)});
+        }
+        vector<bool> keep = ::limit_density(items, max_per_second, max_on_screen);
+        vector<uint32_t> kept;
+        kept.reserve(candidates.size());
+        for (size_t k = 0; k < candidates.size(); ++k) {
+            if (keep[k])
+                kept.push_back(candidates[k]);
+            else
+                stats.density_dropped++;
+        }
+        selected.swap(kept);
+    }
+
+    const vector<uint32_t>& layout_order() const {
+        return merge_window > 0 || max_per_second > 0 || max_on_screen > 0 ? selected : order;
+    }
+
+    // append the Dialogue of the laid out comments to `out` until it holds at least `limit` bytes,
+    // return false once every comment is written. Large outputs are serialized in blocks, each
+    // split into contiguous chunks formatted on worker threads into their own buffers.
+    bool continue_layout(Layout& layout, string& out, size_t limit) {
+        const vector<uint32_t>& comment_order = layout_order();
+        ScopedTimer timer(stats.format);
+        size_t workers = layout.tags.size();
+        while (layout.idx < comment_order.size() && out.size() < limit) {
+            size_t left = comment_order.size() - layout.idx;
+            if (workers == 1 || left < 2 * SERIALIZE_CHUNK) {
+                stats.laid_out += write_comments(comment_order, layout.idx, layout.idx + 1, out, layout.tags[0]);
+                layout.idx++;
+                continue;
+            }
+            size_t n = min(workers, left / SERIALIZE_CHUNK);
+            vector<string> buffers(n);
+            vector<size_t> written(n);
+            run_parallel(n, [&](size_t k) {
+                size_t begin = layout.idx + k * SERIALIZE_CHUNK;
+                written[k] = write_comments(comment_order, begin, begin + SERIALIZE_CHUNK, buffers[k], layout.tags[k]);
+            });
+            for (size_t k = 0; k < n; ++k) {
+                out += buffers[k];
+                stats.laid_out += written[k];
+            }
+            layout.idx += n * SERIALIZE_CHUNK;
+        }
+        stats.body_peak_bytes = max(stats.body_peak_bytes, out.size());
+        return layout.idx < comment_order.size();
+    }
+
+    // append the Dialogue of comment_order[begin, end) to `out` and return how many were written,
+    // only reads the Ass so that chunks can be written concurrently
+    size_t write_comments(const vector<uint32_t>& comment_order, size_t begin, size_t end, string& out,
+                          TagCache& tags) const {
+        size_t written = 0;
+        for (size_t k = begin; k < end; ++k) {
+            const Comment& c = comments[comment_order[k]];
+            if (c.mode == 4)  // bilipos
+                write_bilipos_comment(c, out);
+            else if (c.row != DROPPED_ROW) {
+                write_comment(c, out, tags);
+                written++;
+            }
+        }
+        return written;
+    }
+
+    // find the row of `c` on its stage, or set it to DROPPED_ROW if `reduced` drops it, `counters`
+    // gets the row counters
+    void place_comment(RowIndex& stage_rows, Comment& c, AssStats& counters) const {
+        int row;
+        int row_max = height - reserve_blank - c.part_size;
+        // Keep the row value fixed if the partsize exceeds stage height
+        // https://w.atwiki.jp/commentart2/pages/31.html ③高さ固定
+        if (row_max <= 0) {
+            counters.fixed_rows++;
+            if (c.mode == 0 || c.mode == 3) {
+                c.row = (height - reserve_blank) / 2;
+                c.align = 4;
             } else
-                write_bilipos_comment(c, out_fp);
+                c.row = 0;
+            return;
         }
-        need_clear = false;
+        row = test_free_row(stage_rows, c, row_max, width);
+        if (row < 0) {
+            counters.collisions++;
+            if (reduced) {
+                counters.dropped_reduced++;
+                c.row = DROPPED_ROW;
+                return;
+            }
+            row = find_alternative_row(stage_rows, c, height, reserve_blank);
+            counters.alternative_rows++;
+            if (row == 0) {
+                stage_rows.clear();
+                counters.stage_clears++;
+            }
+        }
+        mark_comment_row(stage_rows, c, row, width);
+        c.row = row;
     }
 
-    void write_comment(Comment& c, std::ofstream* out_fp = nullptr) {
-        vector<string> styles;
+    // find the row of `c` and append its Dialogue unless it is dropped
+    void layout_comment(vector<vector<RowIndex>>& rows, Comment& c, string& out) {
+        if (c.mode == 4) {  // bilipos
+            write_bilipos_comment(c, out);
+            return;
+        }
+        auto t = std::chrono::steady_clock::now();
+        place_comment(rows[c.pool][c.mode], c, stats);
+        auto laid = std::chrono::steady_clock::now();
+        stats.layout += std::chrono::duration<double>(laid - t).count();
+        if (c.row == DROPPED_ROW)
+            return;
+        write_comment(c, out, live_tags);
+        stats.laid_out++;
+        stats.format += seconds_since(laid);
+    }
+
+    // Incremental layout for live danmaku: return the Dialogue lines of the comments added
+    // since the last flush. The row state is kept between flushes and new comments are laid
+    // out against it in (vpos, ctime) order, so a flush costs only the new comments. Comments
+    // within `reorder_window` seconds of the latest vpos are held back until a later flush,
+    // so comments arriving a little late keep their order, `final` flushes them too.
+    string flush(bool final) {
+        if (live_rows.empty())
+            live_rows.assign(3, vector<RowIndex>(4, RowIndex(height - reserve_blank + 1)));
+        for (; live_next < comments.size(); ++live_next) {
+            live_pending.push_back(uint32_t(live_next));
+            live_latest = max(live_latest, comments[live_next].vpos);
+        }
+        auto before = [this](uint32_t a, uint32_t b) {
+            const Comment& x = comments[a];
+            const Comment& y = comments[b];
+            if (x.vpos != y.vpos)
+                return x.vpos < y.vpos;
+            if (x.ctime != y.ctime)
+                return x.ctime < y.ctime;
+            return a < b;
+        };
+        sort(live_pending.begin(), live_pending.end(), before);
+        float cutoff = final ? INFINITY : live_latest - reorder_window;
+        auto ready = find_if(live_pending.begin(), live_pending.end(),
+                             [&](uint32_t i) { return comments[i].vpos > cutoff; });
+        string out;
+        for (auto it = live_pending.begin(); it != ready; ++it) {
+            Comment& c = comments[*it];
+            if (c.vpos < live_frontier)
+                stats.late++;
+            live_frontier = max(live_frontier, c.vpos);
+            c.fit_stage(width, height, duration_marquee);
+            c.repeats = 1;  // flush does not merge
+            layout_comment(live_rows, c, out);
+        }
+        live_pending.erase(live_pending.begin(), ready);
+        stats.body_peak_bytes = max(stats.body_peak_bytes, out.size());
+        return out;
+    }
+
+    void write_comment(const Comment& c, string& out, TagCache& tags) const {
+        auto it = std::back_inserter(out);
+        fmt::format_to(it, "Dialogue: 2,{},{},danmakuC,,0000,0000,0000,,{{",
+                       convert_progress(c.progress), convert_progress(c.progress + c.duration));
         switch (c.mode) {
             case 1: {
                 if (c.lines > 1)
-                    styles.push_back(fmt::format("\\pos({:.0f}, {})",
-                                             (width - c.max_len) / 2, c.row));
+                    fmt::format_to(it, "\\pos({:.0f}, {})", (width - c.max_len) / 2, c.row);
                 else
-                    styles.push_back(fmt::format("\\an8\\pos({}, {})",
-                                             width / 2, c.row));
+                    fmt::format_to(it, "\\an8\\pos({}, {})", width / 2, c.row);
                 break;
             }
             case 2: {
                 if (c.lines > 1)
-                    styles.push_back(fmt::format("\\an1\\pos({:.0f}, {})",
-                                             (width - c.max_len) / 2, convert_type2(c.row, height, reserve_blank)));
+                    fmt::format_to(it, "\\an1\\pos({:.0f}, {})",
+                                   (width - c.max_len) / 2, convert_type2(c.row, height, reserve_blank));
                 else
-                    styles.push_back(fmt::format("\\an2\\pos({}, {})",
-                                             width / 2, convert_type2(c.row, height, reserve_blank)));
+                    fmt::format_to(it, "\\an2\\pos({}, {})",
+                                   width / 2, convert_type2(c.row, height, reserve_blank));
                 break;
             }
             case 3: {
                 if (c.align == 4)
-                    styles.push_back("\\an4");
-                styles.push_back(fmt::format("\\move({2:.0f}, {1}, {0}, {1})",
-                                             width, c.row, c.delta_l - c.max_len));
+                    out += "\\an4";
+                fmt::format_to(it, "\\move({2:.0f}, {1}, {0}, {1})", width, c.row, c.delta_l - c.max_len);
                 break;
             }
             default: {
                 if (c.align == 4)
-                    styles.push_back("\\an4");
-                styles.push_back(fmt::format("\\move({0:.0f}, {1}, {2}, {1})",
-                                             width - c.delta_l, c.row, -c.max_len));
+                    out += "\\an4";
+                fmt::format_to(it, "\\move({0:.0f}, {1}, {2}, {1})", width - c.delta_l, c.row, -c.max_len);
             }
         }
-        if (c.font != font_face) {
-            styles.push_back(fmt::format("\\fn{}", c.font));
-            if (bold) styles.push_back("\\b0");
+        TagKey key{c.font, c.color, c.size, c.alpha};
+        auto tag = tags.find(key);
+        if (tag == tags.end())
+            tag = tags.emplace(key, override_tags(c)).first;
+        out += tag->second;
+        out += '}';
+        out += texts.view(c.content);
+        if (c.repeats > 1 && merge_style == "count")
+            out += repeat_marker(c.repeats);
+        out += '\n';
+    }
+
+    // the tags after the position, which only depend on the TagKey of `c`
+    string override_tags(const Comment& c) const {
+        string tags;
+        if (c.font != 0) {
+            tags += "\\fn" + font_table.name(c.font);
+            if (bold) tags += "\\b0";
         }
         float size = c.size - font_size;
         if (size <= -1 || size >= 1)
-            styles.push_back(fmt::format("\\fs{:.0f}", c.size));
+            tags += fmt::format("\\fs{:.0f}", c.size);
         if (c.color != 0xFFFFFF) {
-            styles.push_back(fmt::format("\\c&H{}&", convert_color(c.color)));
+            tags += "\\c&H" + convert_color(c.color) + "&";
             if (c.color == 0x000000)
-                styles.push_back("\\3c&H666666&");
-        }
-        if (c.alpha != alpha) {
-            styles.push_back(fmt::format("\\alpha&H{}&", convert_alpha(c.alpha)));
+                tags += "\\3c&H666666&";
         }
-        string line = fmt::format("Dialogue: 2,{0},{1},danmakuC,,0000,0000,0000,,{{{2}}}{3}\n",
-                                  convert_progress(c.progress),
-                                  convert_progress(c.progress + c.duration),
-                                  boost::algorithm::join(styles, ""),
-                                  c.content
-        );
-        if (out_fp == nullptr)
-            body += line;
-        else
-            *out_fp << line;
+        if (c.alpha != alpha)
+            tags += "\\alpha&H" + convert_alpha(c.alpha) + "&";
+        return tags;
     }
 
-    void write_bilipos_comment(Comment& c, std::ofstream* out_fp = nullptr) {
+    void write_bilipos_comment(const Comment& c, string& out) const {
         // todo
         return;
     }
@@ -532,20 +1053,252 @@ public:
     void write_to_file(string out_filename) {
         std::ofstream out_fp;
         out_fp.open(out_filename, std::ofstream::out);
-        out_fp << head;
-        write_comments(&out_fp);
+        string chunk = head;
+        Layout layout = start_layout();
+        bool more;
+        do {
+            more = continue_layout(layout, chunk, 1 << 20);
+            out_fp.write(chunk.data(), chunk.size());
+            chunk.clear();
+        } while (more);
         out_fp.close();
     }
 };
 
+// ass text owned by C++ and exposed through the buffer protocol, so large outputs are not copied into a str
+struct AssBuffer {
+    string data;
+};
+
+// yield the ass text in blocks of at least chunk_size bytes while the layout proceeds, at the
+// stage size w x h if given, the previous stage size is restored when the iteration ends
+class AssChunkIterator {
+public:
+    AssChunkIterator(Ass& ass, size_t chunk_size, int w = 0, int h = 0) : ass(ass), chunk_size(chunk_size ? chunk_size : 1),
+        n_comments(ass.comments.size()), old_width(ass.width), old_height(ass.height) {
+        restage = w > 0 && h > 0 && (w != ass.width || h != ass.height);
+        if (restage)
+            ass.set_stage(w, h);
+        layout = ass.start_layout();
+        chunk = ass.head;
+    }
+
+    ~AssChunkIterator() {
+        restore();
+    }
+
+    // return false when there is nothing left to yield
+    bool next(string& res) {
+        if (ass.comments.size() != n_comments)
+            throw std::runtime_error("comments were added to Ass during iteration");
+        if (more)
+            more = ass.continue_layout(layout, chunk, chunk_size);
+        if (chunk.empty()) {
+            restore();
+            return false;
+        }
+        res.swap(chunk);
+        chunk.clear();
+        return true;
+    }
+
+private:
+    Ass& ass;
+    size_t chunk_size;
+    size_t n_comments;
+    int old_width, old_height;
+    bool restage;
+    Ass::Layout layout;
+    string chunk;
+    bool more = true;
+
+    void restore() {
+        if (restage) {
+            ass.set_stage(old_width, old_height);
+            restage = false;
+        }
+    }
+};
+
 namespace py = pybind11;
 
+namespace {
+// read a Python binary file object in blocks for the stream decoders, the GIL is
+// only held while calling its read method
+class PyReader {
+public:
+    explicit PyReader(py::object fp, size_t block_size = 1 << 20) : read_func(fp.attr("read")), block_size(block_size) {}
+
+    bool read(char* dst, size_t n) {
+        while (n > 0) {
+            if (pos == block.size() && !fill())
+                return false;
+            size_t k = std::min(n, block.size() - pos);
+            std::copy_n(block.data() + pos, k, dst);
+            pos += k;
+            dst += k;
+            n -= k;
+        }
+        return true;
+    }
+
+private:
+    py::object read_func;
+    size_t block_size;
+    string block;
+    size_t pos = 0;
+
+    bool fill() {
+        py::gil_scoped_acquire acquire;
+        block = py::bytes(read_func(block_size));
+        pos = 0;
+        return !block.empty();
+    }
+};
+}  // namespace
+
 PYBIND11_MODULE(ass, m) {
     m.doc() = "pybind11 ass extension"; // optional module docstring
     py::class_<Ass>(m, "Ass")
-            .def(py::init<int, int, int, const string&, float, float, float, float, string, bool, bool, bool>())
-            .def("add_comment", &Ass::add_comment)
+            .def(py::init<int, int, int, const string&, float, float, float, float, const string&, bool, bool, bool>())
+            .def(py::init<int, int, int, const string&, float, float, float, float, const vector<string>&, bool, bool, bool>())
+            .def("add_comment", &Ass::add_comment, py::arg("progress"), py::arg("ctime"), py::arg("content"),
+                 py::arg("size_factor"), py::arg("mode"), py::arg("color"), py::arg("pool"), py::arg("weight") = 0,
+                 py::arg("attr") = 0)
             .def("add_nico_comment", &Ass::add_nico_comment)
-            .def("to_string", &Ass::to_string)
-            .def("write_to_file", &Ass::write_to_file);
+            .def("add_filters", [](Ass& self, const vector<string>& patterns) {
+                for (const string& p: patterns)
+                    self.filter.add_pattern(p);
+            })
+            .def("add_keyword_filters", [](Ass& self, const vector<string>& keywords) {
+                for (const string& k: keywords)
+                    self.filter.add_keyword(k);
+            })
+            .def("stats", [](Ass& self) {
+                const AssStats& s = self.stats;
+                size_t comments_bytes = self.comments.capacity() * sizeof(Comment) + self.texts.capacity() +
+                                        self.order.capacity() * sizeof(uint32_t);
+                py::dict phases, counts, layout, memory, res;
+                phases["decode"] = s.decode;
+                phases["sort"] = s.sort;
+                phases["layout"] = s.layout;
+                phases["format"] = s.format;
+                counts["added"] = s.added;
+                counts["filtered"] = s.filtered;
+                counts["by_mode"] = s.by_mode;
+                counts["by_pool"] = s.by_pool;
+                layout["laid_out"] = s.laid_out;
+                layout["collisions"] = s.collisions;
+                layout["alternative_rows"] = s.alternative_rows;
+                layout["stage_clears"] = s.stage_clears;
+                layout["dropped_reduced"] = s.dropped_reduced;
+                layout["fixed_rows"] = s.fixed_rows;
+                layout["late"] = s.late;
+                layout["merged"] = s.merged;
+                layout["density_dropped"] = s.density_dropped;
+                memory["comments_bytes"] = comments_bytes;
+                memory["body_peak_bytes"] = s.body_peak_bytes;
+                res["phases"] = phases;
+                res["comments"] = counts;
+                res["layout"] = layout;
+                res["memory"] = memory;
+                return res;
+            })
+            .def("filter_stats", [](Ass& self) {
+                py::dict res;
+                for (auto& [pattern, dropped]: self.filter.stats())
+                    res[py::str(pattern)] = dropped;
+                return res;
+            })
+            // the GIL is released for bulk ingestion, layout and output so that conversions
+            // in different threads run in parallel, mail_style callbacks reacquire it
+            .def("add_bilibili_segment", [](Ass& self, py::buffer buffer) {
+                py::buffer_info info = buffer.request();
+                py::gil_scoped_release release;
+                return self.add_bilibili_segment(static_cast<const char*>(info.ptr), info.size * info.itemsize);
+            })
+            .def("add_niconico_stream", [](Ass& self, py::buffer buffer, const function<tuple<int, float, int>(const string&)>& mail_style) {
+                py::buffer_info info = buffer.request();
+                py::gil_scoped_release release;
+                return self.add_niconico_stream(static_cast<const char*>(info.ptr), info.size * info.itemsize, mail_style);
+            })
+            .def("add_niconico_file", &Ass::add_niconico_file, py::call_guard<py::gil_scoped_release>())
+            // stream decoders read file objects block by block, e.g. a gzip.GzipFile decompressing on the fly
+            .def("add_bilibili_reader", [](Ass& self, py::object fp) {
+                PyReader reader(fp);
+                py::gil_scoped_release release;
+                StreamFields<PyReader> elems(reader, 1);  // DmSegMobileReply.elems
+                return self.add_bilibili_elems(elems);
+            })
+            .def("add_niconico_reader", [](Ass& self, py::object fp, const function<tuple<int, float, int>(const string&)>& mail_style) {
+                PyReader reader(fp);
+                py::gil_scoped_release release;
+                StreamFrames<PyReader> frames(reader);
+                return self.add_niconico_frames(frames, mail_style);
+            })
+            .def_readwrite("reorder_window", &Ass::reorder_window)
+            .def_readwrite("workers", &Ass::workers)
+            .def_property("merge_window", [](const Ass& self) { return self.merge_window; },
+                          [](Ass& self, float window) {
+                              self.merge_window = window;
+                              self.need_clear = true;
+                          })
+            .def_property("max_per_second", [](const Ass& self) { return self.max_per_second; },
+                          [](Ass& self, int limit) {
+                              self.max_per_second = limit;
+                              self.need_clear = true;
+                          })
+            .def_property("max_on_screen", [](const Ass& self) { return self.max_on_screen; },
+                          [](Ass& self, int limit) {
+                              self.max_on_screen = limit;
+                              self.need_clear = true;
+                          })
+            .def_property("merge_style", [](const Ass& self) { return self.merge_style; },
+                          [](Ass& self, const string& style) {
+                              if (style != "count" && style != "scale" && style != "none")
+                                  throw std::invalid_argument(fmt::format("unknown merge style: {}", style));
+                              self.merge_style = style;
+                              self.need_clear = true;
+                          })
+            .def_readonly("header", &Ass::head)
+            .def("flush", &Ass::flush, py::arg("final") = false, py::call_guard<py::gil_scoped_release>())
+            .def("to_string", &Ass::to_string, py::call_guard<py::gil_scoped_release>())
+            .def("render", &Ass::render, py::call_guard<py::gil_scoped_release>())
+            .def("to_strings", &Ass::to_strings, py::call_guard<py::gil_scoped_release>())
+            .def("render_to_file", &Ass::render_to_file, py::call_guard<py::gil_scoped_release>())
+            .def("write_to_file", &Ass::write_to_file, py::call_guard<py::gil_scoped_release>())
+            .def("to_buffer", [](Ass& self) {
+                auto res = std::make_unique<AssBuffer>();
+                {
+                    py::gil_scoped_release release;
+                    res->data = self.serialize();
+                }
+                return res;
+            })
+            .def("iter_chunks", [](Ass& self, size_t chunk_size, int width, int height) {
+                // the constructor assigns the rows of every comment
+                py::gil_scoped_release release;
+                return std::make_unique<AssChunkIterator>(self, chunk_size, width, height);
+            }, py::arg("chunk_size") = 1 << 16, py::arg("width") = 0, py::arg("height") = 0, py::keep_alive<0, 1>());
+
+    py::class_<AssBuffer>(m, "AssBuffer", py::buffer_protocol())
+            .def_buffer([](AssBuffer& self) {
+                return py::buffer_info(self.data.data(), 1, py::format_descriptor<uint8_t>::format(), 1,
+                                       {self.data.size()}, {1}, true);
+            })
+            .def("__len__", [](const AssBuffer& self) { return self.data.size(); });
+
+    py::class_<AssChunkIterator>(m, "AssChunkIterator")
+            .def("__iter__", [](py::object self) { return self; })
+            .def("__next__", [](AssChunkIterator& self) {
+                string chunk;
+                bool has_chunk;
+                {
+                    py::gil_scoped_release release;
+                    has_chunk = self.next(chunk);
+                }
+                if (!has_chunk)
+                    throw py::stop_iteration();
+                return py::bytes(chunk);
+            });
 }
@@ -0,0 +1,109 @@
+#pragma once
+#include <cmath>
+#include <cstdint>
+#include <functional>
+#include <queue>
+#include <unordered_map>
+#include <utility>
+#include <vector>
+
+
+// A comment as seen by the density cap: its stage, display interval and priority,
+// a higher priority is kept first.
+struct DensityItem {
+    int stage;
+    float start;
+    float end;
+    uint64_t priority;
+};
+
+// priority of a comment: high-liked first, then higher weight, then shorter text
+inline uint64_t comment_priority(bool liked, int weight, size_t text_size) {
+    uint64_t w = uint64_t(weight < 0 ? 0 : weight > 255 ? 255 : weight);
+    uint64_t len = text_size > UINT32_MAX ? UINT32_MAX : text_size;
+    return (uint64_t(liked) << 40) | (w << 32) | (UINT32_MAX - len);
+}
+
+namespace density {
+// (priority, position), the top of a LowestFirst heap is the comment to drop first:
+// the lowest priority, the latest of equal ones
+using Entry = std::pair<uint64_t, size_t>;
+
+struct LowestFirst {
+    bool operator()(const Entry& a, const Entry& b) const {
+        if (a.first != b.first)
+            return a.first > b.first;
+        return a.second < b.second;
+    }
+};
+
+using Heap = std::priority_queue<Entry, std::vector<Entry>, LowestFirst>;
+}  // namespace density
+
+// Select the comments to keep from `items` in time order so that no stage has more than
+// `max_per_second` comments starting in one second or more than `max_on_screen` comments
+// shown at once, 0 disables a limit. Over budget, the lowest priority comments are dropped,
+// including ones already selected. Return a keep flag for each item.
+inline std::vector<bool> limit_density(const std::vector<DensityItem>& items, int max_per_second, int max_on_screen) {
+    using namespace density;
+    std::vector<bool> keep(items.size(), true);
+    if (max_per_second > 0) {
+        // the heap of a stage holds the kept comments of its current second
+        std::unordered_map<int, std::pair<long, Heap>> seconds;
+        for (size_t i = 0; i < items.size(); ++i) {
+            auto& [second, heap] = seconds[items[i].stage];
+            long s = long(std::floor(items[i].start));
+            if (heap.empty() || s != second) {
+                heap = Heap();
+                second = s;
+            }
+            heap.push({items[i].priority, i});
+            if (heap.size() > size_t(max_per_second)) {
+                keep[heap.top().second] = false;
+                heap.pop();
+            }
+        }
+    }
+    if (max_on_screen > 0) {
+        struct Screen {
+            // kept comments on screen by end time and by priority, entries of comments that
+            // left the screen or were dropped are skipped lazily
+            std::priority_queue<std::pair<float, size_t>, std::vector<std::pair<float, size_t>>, std::greater<>> ends;
+            Heap shown;
+            int count = 0;
+        };
+        std::unordered_map<int, Screen> screens;
+        std::vector<bool> on_screen(items.size(), false);
+        for (size_t i = 0; i < items.size(); ++i) {
+            if (!keep[i])
+                continue;
+            Screen& screen = screens[items[i].stage];
+            while (!screen.ends.empty() && screen.ends.top().first <= items[i].start) {
+                size_t j = screen.ends.top().second;
+                screen.ends.pop();
+                if (on_screen[j]) {
+                    on_screen[j] = false;
+                    screen.count--;
+                }
+            }
+            if (screen.count >= max_on_screen) {
+                while (!on_screen[screen.shown.top().second])
+                    screen.shown.pop();
+                Entry lowest = screen.shown.top();
+                if (LowestFirst()(lowest, {items[i].priority, i})) {
+                    keep[i] = false;
+                    continue;
+                }
+                screen.shown.pop();
+                on_screen[lowest.second] = false;
+                keep[lowest.second] = false;
+                screen.count--;
+            }
+            on_screen[i] = true;
+            screen.count++;
+            screen.ends.push({items[i].end, i});
+            screen.shown.push({items[i].priority, i});
+        }
+    }
+    return keep;
+}
@@ -0,0 +1,188 @@
+#pragma once
+#include <array>
+#include <queue>
+#include <stdexcept>
+#include <regex>
+#include <utility>
+#include <string>
+#include <vector>
+
+
+// Comment filter compiled once per Ass. Plain keywords are matched together by an
+// Aho-Corasick automaton over UTF-8 bytes, the remaining regular expressions are
+// joined into one alternation so each comment is searched once.
+class CommentFilter {
+public:
+    // add a regular expression, patterns without any regex syntax are matched as keywords
+    void add_pattern(const std::string& pattern) {
+        if (pattern.empty())
+            return;
+        if (pattern.find_first_of(R"(\^$.|?*+()[]{})") == std::string::npos)
+            add_keyword(pattern);
+        else {
+            std::regex compiled;
+            try {
+                compiled = std::regex(pattern);
+            } catch (const std::regex_error& e) {
+                throw std::invalid_argument("invalid filter pattern " + pattern + ": " + e.what());
+            }
+            add_rule(pattern, compiled.mark_count(), false);
+        }
+    }
+
+    void add_keyword(const std::string& keyword) {
+        if (!keyword.empty())
+            add_rule(keyword, 0, true);
+    }
+
+    bool empty() const {
+        return rules.empty();
+    }
+
+    // return true and count the drop for the first rule that matches `content`
+    bool match(const std::string& content) {
+        if (rules.empty())
+            return false;
+        if (dirty)
+            compile();
+        int rule = match_keywords(content);
+        if (rule < 0)
+            rule = match_regexes(content);
+        if (rule < 0)
+            return false;
+        rules[rule].dropped++;
+        return true;
+    }
+
+    // (pattern, dropped comments) of each rule in the order they were added
+    std::vector<std::pair<std::string, size_t>> stats() const {
+        std::vector<std::pair<std::string, size_t>> res;
+        for (const Rule& r : rules)
+            res.emplace_back(r.pattern, r.dropped);
+        return res;
+    }
+
+private:
+    struct Rule {
+        std::string pattern;
+        size_t groups;
+        bool keyword;
+        size_t dropped = 0;
+    };
+
+    struct Node {
+        std::array<int, 256> next;
+        int fail = 0;
+        int rule = -1;     // rule of the keyword ending at this node
+        int out = -1;      // nearest node on the fail chain that ends a keyword
+
+        Node() {
+            next.fill(-1);
+        }
+    };
+
+    std::vector<Rule> rules;
+    std::vector<Node> nodes;
+    std::regex combined;
+    // rule of each top-level group of `combined`
+    std::vector<std::pair<size_t, int>> regex_groups;
+    // patterns with backreferences can not be renumbered into the alternation
+    std::vector<std::pair<std::regex, int>> standalone;
+    bool has_regex = false;
+    bool dirty = false;
+
+    void add_rule(const std::string& pattern, size_t groups, bool keyword) {
+        for (const Rule& r : rules)
+            if (r.pattern == pattern && r.keyword == keyword)
+                return;
+        rules.push_back({pattern, groups, keyword});
+        dirty = true;
+    }
+
+    void compile() {
+        nodes.assign(1, Node());
+        std::string alternation;
+        regex_groups.clear();
+        standalone.clear();
+        size_t group = 1;
+        for (size_t i = 0; i < rules.size(); ++i) {
+            const Rule& r = rules[i];
+            if (r.keyword) {
+                int cur = 0;
+                for (unsigned char ch: r.pattern) {
+                    if (nodes[cur].next[ch] < 0) {
+                        nodes[cur].next[ch] = nodes.size();
+                        nodes.emplace_back();
+                    }
+                    cur = nodes[cur].next[ch];
+                }
+                if (nodes[cur].rule < 0)
+                    nodes[cur].rule = i;
+            } else if (std::regex_search(r.pattern, std::regex(R"(\\[1-9])")))
+                standalone.emplace_back(std::regex(r.pattern), i);
+            else {
+                if (!alternation.empty())
+                    alternation += "|";
+                alternation += "(" + r.pattern + ")";
+                regex_groups.emplace_back(group, i);
+                group += r.groups + 1;
+            }
+        }
+        // breadth first to fill fail links and complete the transitions
+        std::queue<int> q;
+        for (int& n: nodes[0].next) {
+            if (n < 0)
+                n = 0;
+            else {
+                nodes[n].fail = 0;
+                q.push(n);
+            }
+        }
+        while (!q.empty()) {
+            int cur = q.front();
+            q.pop();
+            int fail = nodes[cur].fail;
+            nodes[cur].out = nodes[fail].rule >= 0 ? fail : nodes[fail].out;
+            for (int ch = 0; ch < 256; ++ch) {
+                int n = nodes[cur].next[ch];
+                if (n < 0)
+                    nodes[cur].next[ch] = nodes[fail].next[ch];
+                else {
+                    nodes[n].fail = nodes[fail].next[ch];
+                    q.push(n);
+                }
+            }
+        }
+        has_regex = !alternation.empty();
+        if (has_regex)
+            combined = std::regex(alternation, std::regex::optimize);
+        dirty = false;
+    }
+
+    int match_keywords(const std::string& content) const {
+        if (nodes.size() <= 1)
+            return -1;
+        int cur = 0;
+        for (unsigned char ch: content) {
+            cur = nodes[cur].next[ch];
+            if (nodes[cur].rule >= 0)
+                return nodes[cur].rule;
+            if (nodes[cur].out >= 0)
+                return nodes[nodes[cur].out].rule;
+        }
+        return -1;
+    }
+
+    int match_regexes(const std::string& content) const {
+        std::smatch m;
+        if (has_regex && std::regex_search(content, m, combined)) {
+            for (auto [group, rule]: regex_groups)
+                if (m[group].matched)
+                    return rule;
+        }
+        for (auto& [re, rule]: standalone)
+            if (std::regex_search(content, re))
+                return rule;
+        return -1;
+    }
+};
@@ -0,0 +1,35 @@
+#pragma once
+#include <cstddef>
+#include <exception>
+#include <thread>
+#include <vector>
+
+
+// number of worker threads for the parallel layout and serialization, 1 on a single core host
+inline size_t worker_count() {
+    size_t n = std::thread::hardware_concurrency();
+    return n > 1 ? n : 1;
+}
+
+// run task(k) for every k in [0, n), each on its own thread, and rethrow the first exception
+// of a task once all of them have finished
+template <class Task>
+void run_parallel(size_t n, Task&& task) {
+    std::vector<std::thread> workers;
+    std::vector<std::exception_ptr> errors(n);
+    workers.reserve(n);
+    for (size_t k = 0; k < n; ++k) {
+        workers.emplace_back([&task, &errors, k] {
+            try {
+                task(k);
+            } catch (...) {
+                errors[k] = std::current_exception();
+            }
+        });
+    }
+    for (std::thread& w: workers)
+        w.join();
+    for (std::exception_ptr& e: errors)
+        if (e)
+            std::rethrow_exception(e);
+}
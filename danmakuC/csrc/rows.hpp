@@ -0,0 +1,109 @@
+#pragma once
+#include <algorithm>
+#include <cmath>
+#include <vector>
+
+
+// The comment occupying a span of rows, reduced to the keys that collision tests compare.
+// A span blocks a new comment when key1 > x1 or key2 > x2 for the query (x1, x2).
+struct RowOccupant {
+    double key1 = -INFINITY;
+    double key2 = -INFINITY;
+    float progress = 0;
+};
+
+struct RowSpan {
+    int start;
+    int end;
+    RowOccupant occupant;
+};
+
+// Occupancy of the pixel rows of one (pool, mode) stage, kept as the sorted list of
+// occupied row spans instead of one slot per pixel row. Spans are located by binary
+// search and the free row search jumps from span to span, so its cost depends on the
+// number of comments on the stage rather than on the stage height.
+class RowIndex {
+public:
+    explicit RowIndex(int n) : n(n > 0 ? n : 1) {}
+
+    int size() const {
+        return n;
+    }
+
+    // occupy rows [l, r) with `o`
+    void assign(int l, int r, const RowOccupant& o) {
+        r = std::min(r, n);
+        if (l >= r)
+            return;
+        // first span ending after l, and first span starting at or after r
+        auto first = std::upper_bound(spans.begin(), spans.end(), l,
+                                      [](int row, const RowSpan& s) { return row < s.end; });
+        auto last = std::lower_bound(first, spans.end(), r,
+                                     [](const RowSpan& s, int row) { return s.start < row; });
+        // keep the parts of the overlapped spans outside [l, r)
+        RowSpan head{0, 0, {}}, tail{0, 0, {}};
+        bool has_head = first != last && first->start < l;
+        bool has_tail = first != last && (last - 1)->end > r;
+        if (has_head)
+            head = {first->start, l, first->occupant};
+        if (has_tail)
+            tail = {r, (last - 1)->end, (last - 1)->occupant};
+        auto it = spans.erase(first, last);
+        if (has_tail)
+            it = spans.insert(it, tail);
+        it = spans.insert(it, {l, r, o});
+        if (has_head)
+            spans.insert(it, head);
+    }
+
+    void clear() {
+        spans.clear();
+    }
+
+    // first row in [0, row_max] such that no span within [row, row + len) blocks the
+    // query (x1, x2), -1 if there is none
+    int find_free(int row_max, int len, double x1, double x2) const {
+        int row = 0;
+        for (const RowSpan& s : spans) {
+            if (s.start >= row + len)
+                break;
+            if (s.occupant.key1 > x1 || s.occupant.key2 > x2) {
+                // every row up to the end of a blocking span fails as well
+                row = s.end;
+                if (row > row_max)
+                    return -1;
+            }
+        }
+        return row <= row_max ? row : -1;
+    }
+
+    // first empty row in [0, r), -1 if there is none
+    int first_empty(int r) const {
+        int row = 0;
+        for (const RowSpan& s : spans) {
+            if (row >= r || s.start > row)
+                break;
+            row = s.end;
+        }
+        return row < r ? row : -1;
+    }
+
+    // first row in [0, r) whose occupant has the smallest progress
+    int first_min_progress(int r) const {
+        int res = -1;
+        float progress = 0;
+        for (const RowSpan& s : spans) {
+            if (s.start >= r)
+                break;
+            if (res < 0 || s.occupant.progress < progress) {
+                res = s.start;
+                progress = s.occupant.progress;
+            }
+        }
+        return res;
+    }
+
+private:
+    int n;
+    std::vector<RowSpan> spans;
+};
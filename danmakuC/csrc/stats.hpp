@@ -0,0 +1,60 @@
+#pragma once
+#include <chrono>
+#include <cstddef>
+#include <map>
+
+
+// Phase timings (seconds) and counters of an Ass, see Ass.stats()
+struct AssStats {
+    double decode = 0;  // native decoders, including the ingestion of the decoded comments
+    double sort = 0;
+    double layout = 0;  // row allocation
+    double format = 0;  // Dialogue serialization
+    size_t added = 0;
+    size_t filtered = 0;
+    std::map<int, size_t> by_mode;
+    std::map<int, size_t> by_pool;
+    // counters of the last layout pass
+    size_t laid_out = 0;
+    size_t collisions = 0;        // comments without a free row
+    size_t alternative_rows = 0;  // collisions placed over other comments
+    size_t stage_clears = 0;      // alternative rows at the top, which clear the stage
+    size_t dropped_reduced = 0;   // collisions dropped because of `reduced`
+    size_t fixed_rows = 0;        // comments taller than the stage
+    size_t merged = 0;            // repeats folded into an earlier comment, see Ass::merge_repeats
+    size_t density_dropped = 0;   // comments over the density cap, see Ass::limit_density
+    size_t late = 0;              // flushed after a comment with a later vpos, see Ass::flush
+    size_t body_peak_bytes = 0;
+
+    // add the row counters of a layout done separately, see Ass::assign_rows
+    void add_row_counters(const AssStats& o) {
+        collisions += o.collisions;
+        alternative_rows += o.alternative_rows;
+        stage_clears += o.stage_clears;
+        dropped_reduced += o.dropped_reduced;
+        fixed_rows += o.fixed_rows;
+    }
+
+    void reset_layout() {
+        sort = layout = format = 0;
+        laid_out = collisions = alternative_rows = stage_clears = dropped_reduced = fixed_rows = merged = density_dropped = 0;
+    }
+};
+
+inline double seconds_since(std::chrono::steady_clock::time_point start) {
+    return std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+}
+
+// add the lifetime of the timer to `total`
+class ScopedTimer {
+public:
+    explicit ScopedTimer(double& total) : total(total), start(std::chrono::steady_clock::now()) {}
+
+    ~ScopedTimer() {
+        total += seconds_since(start);
+    }
+
+private:
+    double& total;
+    std::chrono::steady_clock::time_point start;
+};
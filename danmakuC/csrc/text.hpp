@@ -0,0 +1,59 @@
+#pragma once
+#include <string>
+#include <string_view>
+#include "width.hpp"
+
+
+struct TextMetrics {
+    int lines = 1;
+    float max_width = 0;  // width of the widest line in em
+};
+
+// Normalize comment text for an ass Dialogue in one pass: tabs become two full-width
+// spaces (ass renderers ignore tabs), "\" is followed by a zero width space so it can
+// not escape anything, braces are escaped, line breaks become \N and the text is
+// wrapped in zero width spaces to keep leading and trailing spaces. The escaped text is
+// written to `out`, which can be reused between comments, and the lines are measured
+// on the way.
+inline TextMetrics normalize_text(std::string_view s, std::string& out, TextWidthCache& widths) {
+    static const std::string_view ZERO_WIDTH_SPACE = "\xe2\x80\x8b";  // U+200B
+    static const std::string_view FULL_WIDTH_SPACE = "\xe3\x80\x80";  // U+3000
+    TextMetrics m;
+    out.clear();
+    out += ZERO_WIDTH_SPACE;
+    size_t run = 0;         // start of the bytes not copied yet
+    size_t line_start = 0;
+    for (size_t i = 0; i < s.size(); ++i) {
+        char c = s[i];
+        if (c != '\\' && c != '{' && c != '}' && c != '\t' && c != '\n')
+            continue;
+        out.append(s.data() + run, i - run);
+        run = i + 1;
+        switch (c) {
+            case '\\':
+                out += '\\';
+                out += ZERO_WIDTH_SPACE;
+                break;
+            case '{':
+            case '}':
+                out += '\\';
+                out += c;
+                break;
+            case '\t':
+                out += FULL_WIDTH_SPACE;
+                out += FULL_WIDTH_SPACE;
+                break;
+            default:  // '\n'
+                out += ZERO_WIDTH_SPACE;
+                out += "\\N";
+                out += ZERO_WIDTH_SPACE;
+                m.max_width = std::max(m.max_width, widths.width(s.substr(line_start, i - line_start)));
+                m.lines++;
+                line_start = i + 1;
+        }
+    }
+    out.append(s.data() + run, s.size() - run);
+    out += ZERO_WIDTH_SPACE;
+    m.max_width = std::max(m.max_width, widths.width(s.substr(line_start)));
+    return m;
+}
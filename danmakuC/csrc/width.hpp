@@ -0,0 +1,136 @@
+#pragma once
+#include <algorithm>
+#include <cstdint>
+#include <string>
+#include <string_view>
+#include <unordered_map>
+#include <utility>
+
+
+// Display width of comment text in em: full-width characters (CJK, kana, hangul,
+// full-width forms, emoji) take 1, zero-width characters (combining marks, joiners,
+// variation selectors, controls) take 0 and the others take 0.5.
+// Ranges follow Unicode EastAsianWidth W/F, the ambiguous symbols that CJK fonts
+// draw full-width (arrows, circled numbers, box drawing, shapes, dingbats) are wide.
+
+// decode one code point and advance `p`, an invalid sequence yields U+FFFD and skips one byte
+inline uint32_t decode_utf8(const char*& p, const char* end) {
+    const uint8_t* s = reinterpret_cast<const uint8_t*>(p);
+    uint8_t c = s[0];
+    if (c < 0x80) {
+        ++p;
+        return c;
+    }
+    int n;
+    uint32_t cp;
+    if ((c & 0xE0) == 0xC0)
+        n = 1, cp = c & 0x1F;
+    else if ((c & 0xF0) == 0xE0)
+        n = 2, cp = c & 0x0F;
+    else if ((c & 0xF8) == 0xF0)
+        n = 3, cp = c & 0x07;
+    else {
+        ++p;
+        return 0xFFFD;
+    }
+    if (end - p <= n) {
+        ++p;
+        return 0xFFFD;
+    }
+    for (int i = 1; i <= n; ++i) {
+        if ((s[i] & 0xC0) != 0x80) {
+            ++p;
+            return 0xFFFD;
+        }
+        cp = (cp << 6) | (s[i] & 0x3F);
+    }
+    p += n + 1;
+    return cp;
+}
+
+namespace width_table {
+using Range = std::pair<uint32_t, uint32_t>;
+
+inline const Range zero[] = {
+    {0x0000, 0x001F}, {0x007F, 0x009F}, {0x00AD, 0x00AD}, {0x0300, 0x036F}, {0x0483, 0x0489},
+    {0x0591, 0x05BD}, {0x05BF, 0x05BF}, {0x05C1, 0x05C2}, {0x05C4, 0x05C5}, {0x05C7, 0x05C7},
+    {0x0610, 0x061A}, {0x061C, 0x061C}, {0x064B, 0x065F}, {0x0670, 0x0670}, {0x06D6, 0x06DC},
+    {0x06DF, 0x06E4}, {0x06E7, 0x06E8}, {0x06EA, 0x06ED}, {0x0E31, 0x0E31}, {0x0E34, 0x0E3A},
+    {0x0E47, 0x0E4E}, {0x1160, 0x11FF}, {0x1AB0, 0x1AFF}, {0x1DC0, 0x1DFF}, {0x200B, 0x200F},
+    {0x2028, 0x202E}, {0x2060, 0x2064}, {0x20D0, 0x20FF}, {0x302A, 0x302D}, {0x3099, 0x309A},
+    {0xFE00, 0xFE0F}, {0xFE20, 0xFE2F}, {0xFEFF, 0xFEFF}, {0x1F3FB, 0x1F3FF}, {0xE0000, 0xE007F},
+    {0xE0100, 0xE01EF},
+};
+
+inline const Range wide[] = {
+    {0x1100, 0x115F}, {0x2190, 0x21FF}, {0x231A, 0x231B}, {0x2329, 0x232A}, {0x23E9, 0x23EC},
+    {0x23F0, 0x23F0}, {0x23F3, 0x23F3}, {0x2460, 0x24FF}, {0x2500, 0x27BF}, {0x2B1B, 0x2B1C},
+    {0x2B50, 0x2B50}, {0x2B55, 0x2B55}, {0x2E80, 0x303E}, {0x3041, 0x33FF}, {0x3400, 0x4DBF},
+    {0x4E00, 0x9FFF}, {0xA000, 0xA4CF}, {0xA960, 0xA97F}, {0xAC00, 0xD7A3}, {0xF900, 0xFAFF},
+    {0xFE10, 0xFE19}, {0xFE30, 0xFE6F}, {0xFF00, 0xFF60}, {0xFFE0, 0xFFE6}, {0x16FE0, 0x16FE4},
+    {0x17000, 0x18AFF}, {0x1B000, 0x1B2FF}, {0x1F004, 0x1F004}, {0x1F0CF, 0x1F0CF}, {0x1F18E, 0x1F18E},
+    {0x1F191, 0x1F19A}, {0x1F200, 0x1F202}, {0x1F210, 0x1F23B}, {0x1F240, 0x1F248}, {0x1F250, 0x1F251},
+    {0x1F260, 0x1F265}, {0x1F300, 0x1F64F}, {0x1F680, 0x1F6FF}, {0x1F7E0, 0x1F7EB}, {0x1F90C, 0x1F9FF},
+    {0x1FA70, 0x1FAFF}, {0x20000, 0x2FFFD}, {0x30000, 0x3FFFD},
+};
+
+template <size_t N>
+bool contains(const Range (&table)[N], uint32_t cp) {
+    auto it = std::upper_bound(table, table + N, cp, [](uint32_t c, const Range& r) { return c < r.first; });
+    return it != table && cp <= (it - 1)->second;
+}
+}  // namespace width_table
+
+// width of a code point in half em, a tab is rendered as two full-width spaces
+inline int char_width(uint32_t cp) {
+    if (cp < 0x7F)
+        return cp >= 0x20 ? 1 : cp == '\t' ? 4 : 0;
+    if (cp >= 0x4E00 && cp <= 0x9FFF)
+        return 2;
+    if (width_table::contains(width_table::zero, cp))
+        return 0;
+    return width_table::contains(width_table::wide, cp) ? 2 : 1;
+}
+
+// width of a line in em, decoded in one pass without allocation
+inline float text_width(std::string_view line) {
+    const char* p = line.data();
+    const char* end = p + line.size();
+    int units = 0;
+    while (p < end)
+        units += char_width(decode_utf8(p, end));
+    return units / 2.0f;
+}
+
+// Memoized text_width, danmaku text repeats a lot ("233333", "哈哈哈"). The cache is
+// bounded, it is cleared when full, and only short lines are kept.
+class TextWidthCache {
+public:
+    explicit TextWidthCache(size_t capacity = 1 << 14, size_t max_line = 64) : capacity(capacity), max_line(max_line) {}
+
+    float width(std::string_view line) {
+        if (line.size() > max_line)
+            return text_width(line);
+        key.assign(line.data(), line.size());
+        auto it = cache.find(key);
+        if (it != cache.end()) {
+            hits++;
+            return it->second;
+        }
+        misses++;
+        float w = text_width(line);
+        if (cache.size() >= capacity)
+            cache.clear();
+        cache.emplace(key, w);
+        return w;
+    }
+
+    size_t hits = 0;
+    size_t misses = 0;
+
+private:
+    size_t capacity;
+    size_t max_line;
+    std::string key;
+    std::unordered_map<std::string, float> cache;
+};
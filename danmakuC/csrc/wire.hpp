@@ -0,0 +1,250 @@
+#pragma once
+#include <algorithm>
+#include <cstdint>
+#include <cstddef>
+#include <stdexcept>
+#include <string>
+#include <string_view>
+
+
+// Minimal reader for the protobuf wire format, just enough to decode comment
+// messages without building Python protobuf objects.
+// https://protobuf.dev/programming-guides/encoding/
+enum WireType {
+    WIRE_VARINT = 0,
+    WIRE_I64 = 1,
+    WIRE_LEN = 2,
+    WIRE_I32 = 5,
+};
+
+class WireReader {
+public:
+    const char* p;
+    const char* end;
+
+    WireReader(const char* data, size_t size) : p(data), end(data + size) {}
+
+    explicit WireReader(std::string_view s) : p(s.data()), end(s.data() + s.size()) {}
+
+    bool eof() const {
+        return p >= end;
+    }
+
+    uint64_t read_varint() {
+        uint64_t value = 0;
+        for (int shift = 0; shift < 64; shift += 7) {
+            if (p >= end)
+                throw std::invalid_argument("truncated protobuf varint");
+            uint8_t byte = *p++;
+            value |= uint64_t(byte & 0x7F) << shift;
+            if (!(byte & 0x80))
+                return value;
+        }
+        throw std::invalid_argument("malformed protobuf varint");
+    }
+
+    // return the field number, the wire type is stored in `wire_type`
+    uint32_t read_tag(int& wire_type) {
+        uint64_t tag = read_varint();
+        wire_type = tag & 0x07;
+        return tag >> 3;
+    }
+
+    std::string_view read_bytes() {
+        uint64_t len = read_varint();
+        if (len > uint64_t(end - p))
+            throw std::invalid_argument("truncated protobuf field");
+        std::string_view s(p, len);
+        p += len;
+        return s;
+    }
+
+    void skip(int wire_type) {
+        switch (wire_type) {
+            case WIRE_VARINT:
+                read_varint();
+                break;
+            case WIRE_I64:
+                advance(8);
+                break;
+            case WIRE_LEN:
+                read_bytes();
+                break;
+            case WIRE_I32:
+                advance(4);
+                break;
+            default:
+                throw std::invalid_argument("unsupported protobuf wire type");
+        }
+    }
+
+private:
+    void advance(size_t n) {
+        if (n > size_t(end - p))
+            throw std::invalid_argument("truncated protobuf field");
+        p += n;
+    }
+};
+
+// Frames of a length-prefixed message stream: 4-byte big-endian size followed
+// by the message, a zero size (or the end of input) terminates the stream.
+inline uint32_t read_be32(const char* p) {
+    const uint8_t* b = reinterpret_cast<const uint8_t*>(p);
+    return (uint32_t(b[0]) << 24) | (uint32_t(b[1]) << 16) | (uint32_t(b[2]) << 8) | uint32_t(b[3]);
+}
+
+// Read `n` bytes of `in` into `buffer`, growing it at most 64 KiB at a time so a
+// corrupt length cannot request a huge allocation before the input runs out.
+template <class Stream>
+bool read_bounded(Stream& in, std::string& buffer, uint64_t n) {
+    buffer.clear();
+    while (buffer.size() < n) {
+        size_t offset = buffer.size();
+        size_t k = std::min<uint64_t>(n - offset, 1 << 16);
+        buffer.resize(offset + k);
+        if (!in.read(&buffer[offset], k))
+            return false;
+    }
+    return true;
+}
+
+class BufferFrames {
+public:
+    const char* p;
+    const char* end;
+
+    BufferFrames(const char* data, size_t size) : p(data), end(data + size) {}
+
+    bool next(std::string_view& frame) {
+        if (end - p < 4)
+            return false;
+        uint32_t size = read_be32(p);
+        if (size == 0)
+            return false;
+        p += 4;
+        if (size > size_t(end - p))
+            throw std::invalid_argument("truncated length-prefixed message");
+        frame = std::string_view(p, size);
+        p += size;
+        return true;
+    }
+};
+
+template <class Stream>
+class StreamFrames {
+public:
+    Stream& in;
+    std::string buffer;
+
+    explicit StreamFrames(Stream& in) : in(in) {}
+
+    bool next(std::string_view& frame) {
+        char prefix[4];
+        if (!in.read(prefix, 4))
+            return false;
+        uint32_t size = read_be32(prefix);
+        if (size == 0)
+            return false;
+        if (!read_bounded(in, buffer, size))
+            throw std::invalid_argument("truncated length-prefixed message");
+        frame = std::string_view(buffer.data(), size);
+        return true;
+    }
+};
+
+// Length-delimited fields `field` of one message, such as the repeated elems of a
+// DmSegMobileReply, so the message is decoded one submessage at a time.
+class BufferFields {
+public:
+    BufferFields(const char* data, size_t size, uint32_t field) : reader(data, size), field(field) {}
+
+    bool next(std::string_view& value) {
+        while (!reader.eof()) {
+            int wire_type;
+            uint32_t f = reader.read_tag(wire_type);
+            if (f == field && wire_type == WIRE_LEN) {
+                value = reader.read_bytes();
+                return true;
+            }
+            reader.skip(wire_type);
+        }
+        return false;
+    }
+
+private:
+    WireReader reader;
+    uint32_t field;
+};
+
+// Same as BufferFields but read from a stream, only the current field is kept in memory.
+// `Stream::read(char*, size_t)` must convert to false when fewer bytes are left.
+template <class Stream>
+class StreamFields {
+public:
+    std::string buffer;
+
+    StreamFields(Stream& in, uint32_t field) : in(in), field(field) {}
+
+    bool next(std::string_view& value) {
+        uint64_t tag;
+        while (read_varint(tag, true)) {
+            int wire_type = tag & 0x07;
+            uint64_t len;
+            switch (wire_type) {
+                case WIRE_VARINT:
+                    read_varint(len, false);
+                    break;
+                case WIRE_I64:
+                    read(8);
+                    break;
+                case WIRE_I32:
+                    read(4);
+                    break;
+                case WIRE_LEN:
+                    read_varint(len, false);
+                    if ((tag >> 3) == field) {
+                        read(len);
+                        value = std::string_view(buffer.data(), len);
+                        return true;
+                    }
+                    // skip in bounded steps
+                    while (len > 0) {
+                        uint64_t n = std::min<uint64_t>(len, 1 << 16);
+                        read(n);
+                        len -= n;
+                    }
+                    break;
+                default:
+                    throw std::invalid_argument("unsupported protobuf wire type");
+            }
+        }
+        return false;
+    }
+
+private:
+    Stream& in;
+    uint32_t field;
+
+    // return false at the end of the stream if `at_start`, a truncated varint throws
+    bool read_varint(uint64_t& value, bool at_start) {
+        value = 0;
+        for (int shift = 0; shift < 64; shift += 7) {
+            char c;
+            if (!in.read(&c, 1)) {
+                if (at_start && shift == 0)
+                    return false;
+                throw std::invalid_argument("truncated protobuf varint");
+            }
+            uint8_t byte = c;
+            value |= uint64_t(byte & 0x7F) << shift;
+            if (!(byte & 0x80))
+                return true;
+        }
+        throw std::invalid_argument("malformed protobuf varint");
+    }
+
+    void read(uint64_t n) {
+        if (!read_bounded(in, buffer, n))
+            throw std::invalid_argument("truncated protobuf field");
+    }
+};
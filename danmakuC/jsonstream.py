@@ -0,0 +1,181 @@
+import codecs
+import json
+import re
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, TextIO, Tuple, Union
+
+__all__ = ['JsonStream', 'iter_thread_comments']
+
+CHUNK_SIZE = 1 << 16
+STRUCTURE_KEYS = ("data", "threads", "comments")
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+
+class JsonStream:
+    """pull reader of a JSON text read chunk by chunk, only the value being decoded is held in memory"""
+
+    def __init__(self, source: Union[str, bytes, BinaryIO, TextIO], chunk_size: int = CHUNK_SIZE):
+        self.fp = None
+        self.buf = ""
+        self.pos = 0
+        self.eof = True
+        if isinstance(source, bytes):
+            self.buf = source.decode('utf-8-sig')
+        elif isinstance(source, str):
+            self.buf = source
+        else:
+            self.fp = source
+            self.eof = False
+            self.chunk_size = chunk_size
+            self.decoder = codecs.getincrementaldecoder('utf-8-sig')()
+
+    def _fill(self, size: int = 0) -> bool:
+        """read at least `size` more characters or up to the end, return False at the end"""
+        if self.eof:
+            return False
+        parts = [self.buf[self.pos:]]
+        self.pos = 0
+        n = 0
+        while n < max(size, 1):
+            data = self.fp.read(max(size, self.chunk_size))
+            if not data:
+                parts.append(self.decoder.decode(b'', final=True))
+                self.eof = True
+                break
+            text = data if isinstance(data, str) else self.decoder.decode(data)
+            parts.append(text)
+            n += len(text)
+        self.buf = "".join(parts)
+        return n > 0 or bool(parts[-1])
+
+    def peek(self) -> str:
+        """the next non-whitespace character, "" at the end"""
+        while True:
+            self.pos = _whitespace.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def consume(self, char: str) -> bool:
+        if self.pos < len(self.buf) and self.buf[self.pos] == char:
+            self.pos += 1
+            return True
+        if self.peek() != char:
+            return False
+        self.pos += 1
+        return True
+
+    def expect(self, char: str):
+        if not self.consume(char):
+            raise ValueError(f"expected {char!r} in JSON, got {self.peek()!r}")
+
+    def value(self, max_buffer: int = 0) -> Any:
+        """decode the next value, if max_buffer is given and the value is not complete within max_buffer
+        characters, return `self` instead and leave the position unchanged"""
+        if self.pos >= len(self.buf) or self.buf[self.pos] in " \t\n\r":
+            self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if max_buffer and len(self.buf) - self.pos >= max_buffer:
+                    return self
+                # the buffer is grown geometrically, so a large value is decoded a few times at most
+                if not self._fill(len(self.buf) - self.pos):
+                    raise
+                continue
+            # a number at the end of the buffer may go on in the next chunk
+            if end == len(self.buf) and not self.eof:
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+
+def _is_comment(value: Any) -> bool:
+    return type(value) is dict and "comments" not in value and "threads" not in value and "data" not in value
+
+
+def _items(s: JsonStream) -> Iterator[Any]:
+    """decoded items of the list at the position of `s`, `s` itself for an item too large to
+    decode at once, which must be walked before the next item"""
+    s.expect("[")
+    if s.consume("]"):
+        return
+    while True:
+        yield s.value(CHUNK_SIZE)
+        if s.consume("]"):
+            return
+        s.expect(",")
+
+
+def _walk_decoded(value: Any, fork: str) -> Iterator[Tuple[str, dict]]:
+    if isinstance(value, list):
+        for item in value:
+            yield from _walk_decoded(item, fork)
+    elif isinstance(value, dict):
+        if _is_comment(value):
+            yield fork, value
+            return
+        fork = value.get("fork", fork)
+        for key in STRUCTURE_KEYS:
+            if key == "comments" and isinstance(value.get(key), list):
+                yield from _thread_comments(fork, value[key])
+            elif key in value:
+                yield from _walk_decoded(value[key], fork)
+
+
+def _walk(s: JsonStream, fork: str) -> Iterator[Tuple[str, dict]]:
+    char = s.peek()
+    if char == "[":
+        # comments are small and decoded at once, larger items (threads) are walked key by key
+        for item in _items(s):
+            if _is_comment(item):
+                yield fork, item
+            elif item is s:
+                yield from _walk(s, fork)
+            else:
+                yield from _walk_decoded(item, fork)
+    elif char == "{":
+        yield from _walk_object(s, fork)
+    else:
+        s.value()
+
+
+def _thread_comments(fork: str, comments: Iterable[dict]) -> Iterator[Tuple[str, dict]]:
+    if fork == "owner":
+        # owner comments are few and nicoscript needs them in vpos order
+        comments = sorted(comments, key=lambda c: c["vposMs"])
+    for comment in comments:
+        yield fork, comment
+
+
+def _walk_object(s: JsonStream, fork: str) -> Iterator[Tuple[str, dict]]:
+    # the fork of a thread is read before its comments, as in nvComment responses
+    s.expect("{")
+    fields: Dict[str, Any] = {}
+    structure = False
+    while not s.consume("}"):
+        key = s.value()
+        s.expect(":")
+        if key in STRUCTURE_KEYS:
+            structure = True
+            thread_fork = fields.get("fork", fork)
+            if key == "comments" and thread_fork == "owner":
+                yield from _thread_comments(thread_fork, [comment for _, comment in _walk(s, thread_fork)])
+            else:
+                yield from _walk(s, thread_fork)
+        else:
+            fields[key] = s.value()
+        s.consume(",")
+    if not structure:
+        yield fork, fields
+
+
+def iter_thread_comments(source: Union[str, bytes, BinaryIO, TextIO]) -> Iterator[Tuple[str, dict]]:
+    """yield (fork, comment) of niconico comment JSON while it is read: an nvComment response
+    ({"data": {"threads": [...]}}), a list of threads, a thread ({"fork": ..., "comments": [...]}) or
+    a list of comments. Owner comments of a thread are yielded sorted by vposMs."""
+    return _walk(JsonStream(source), "")
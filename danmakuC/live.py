@@ -0,0 +1,188 @@
+"""Convert a live comment stream to rolling ass files with asyncio.
+
+Comments are read from an async iterator into a bounded queue, so a slow conversion holds back
+the source instead of buffering without limit. They are taken from the queue in batches, and
+each batch is added to the Ass, laid out incrementally (Ass.flush) and appended to the current
+output file in a worker thread, so the event loop keeps serving the source meanwhile.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterable, List, Optional, Sequence, Union
+from . import bilibili, niconico
+from .ass import Ass
+from .profile import PhaseTimer, record_stats
+
+__all__ = ['live2ass']
+
+
+def add_niconico(ass: Ass, scripts: niconico.NicoScriptEngine, comment: dict, duration_marquee: float,
+                 duration_still: float) -> bool:
+    """add a niconico comment, either an nvComment dict (vposMs, body, commands, postedAt, fork)
+    or a niconama/legacy chat dict (vpos, content, mail, date)"""
+    if "vposMs" in comment:
+        vpos = comment["vposMs"] / 1000
+    else:
+        vpos = comment.get("vpos", 0) / 100
+    text = comment.get("body", comment.get("content", ""))
+    mail = comment.get("commands", comment.get("mail", ""))
+    date = niconico.parse_posted_at(comment["postedAt"]) if "postedAt" in comment else comment.get("date", 0)
+    return niconico.add_chat(ass, scripts, vpos, int(date), text, mail, comment.get("fork", ""),
+                             duration_marquee, duration_still, True)
+
+
+class RollingWriter:
+    """append Dialogue lines to the current output file and start a new one, with the ass header,
+    after roll_seconds or once it holds roll_bytes"""
+
+    def __init__(self, out_filename: str, header: str, roll_seconds: float = 0, roll_bytes: int = 0):
+        self.out_filename = out_filename
+        self.header = header.encode('utf8')
+        self.roll_seconds = roll_seconds
+        self.roll_bytes = roll_bytes
+        self.filenames: List[str] = []
+        self.file = None
+        self.size = 0
+        self.opened = 0.0
+
+    def filename(self, index: int) -> str:
+        if "{index" in self.out_filename:
+            return self.out_filename.format(index=index)
+        if not (self.roll_seconds or self.roll_bytes):
+            return self.out_filename
+        stem, ext = os.path.splitext(self.out_filename)
+        return f"{stem}_{index:03d}{ext}"
+
+    def open(self):
+        self.close()
+        filename = self.filename(len(self.filenames))
+        self.file = open(filename, 'wb')
+        self.file.write(self.header)
+        self.size = len(self.header)
+        self.opened = time.monotonic()
+        self.filenames.append(filename)
+
+    def should_roll(self) -> bool:
+        return ((self.roll_bytes and self.size >= self.roll_bytes) or
+                (self.roll_seconds and time.monotonic() - self.opened >= self.roll_seconds))
+
+    def write(self, lines: str):
+        if self.file is None or self.should_roll():
+            self.open()
+        data = lines.encode('utf8')
+        self.file.write(data)
+        self.file.flush()
+        self.size += len(data)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+async def live2ass(
+        source: AsyncIterable[Any],
+        out_filename: str,
+        width: int,
+        height: int,
+        platform: str = "bilibili",
+        reserve_blank: int = 0,
+        font_face: str = "sans-serif",
+        font_size: float = 25.0,
+        alpha: float = 1.0,
+        duration_marquee: float = 5.0,
+        duration_still: float = 5.0,
+        comment_filter: Union[str, Sequence[str]] = "",
+        reduced: bool = False,
+        bold: bool = False,
+        reorder_window: float = 0.0,
+        batch_size: int = 1024,
+        queue_size: int = 16384,
+        flush_interval: float = 1.0,
+        roll_seconds: float = 0,
+        roll_bytes: int = 0,
+        stats: Optional[dict] = None,
+) -> List[str]:
+    """Convert comments from `source` until it ends and return the written filenames.
+
+    Items of `source` are bilibili DanmakuElem messages or dicts of their fields (platform="bilibili"),
+    or niconico comment dicts (platform="niconico"). At most `queue_size` comments wait for conversion,
+    and at most `batch_size` of them are converted at once. Output goes to `out_filename`, or to
+    numbered files (`out_filename` may contain `{index}`, otherwise _000, _001... is appended) when
+    roll_seconds or roll_bytes is set. Comments within `reorder_window` seconds of the latest one
+    are held back for late arrivals, see Ass.flush.
+    """
+    if platform == "bilibili":
+        def add(ass, comment):
+            return bilibili.add_elem(ass, comment)
+    elif platform == "niconico":
+        scripts = niconico.NicoScriptEngine()
+
+        def add(ass, comment):
+            return add_niconico(ass, scripts, comment, duration_marquee, duration_still)
+    else:
+        raise ValueError(f"unsupported platform: {platform}")
+
+    timer = PhaseTimer()
+    ass = Ass(width, height, reserve_blank, font_face, font_size, alpha, duration_marquee,
+              duration_still, comment_filter, reduced, bold, True)
+    ass.reorder_window = reorder_window
+    writer = RollingWriter(out_filename, ass.header, roll_seconds, roll_bytes)
+
+    def convert(batch: list, final: bool):
+        for comment in batch:
+            add(ass, comment)
+        timer.lap("comments")
+        lines = ass.flush(final)
+        if lines or final or writer.file is None:
+            writer.write(lines)
+        timer.lap("output")
+
+    queue: asyncio.Queue = asyncio.Queue(queue_size)
+    ended = asyncio.Event()
+
+    async def produce():
+        try:
+            async for comment in source:
+                await queue.put(comment)
+        finally:
+            ended.set()
+
+    loop = asyncio.get_running_loop()
+    # one worker thread, an Ass must not be used by several threads at the same time
+    executor = ThreadPoolExecutor(1)
+    producer = asyncio.ensure_future(produce())
+    end = asyncio.ensure_future(ended.wait())
+    # the pending get is kept across timeouts, cancelling it could drop a comment it already took
+    getter = None
+    try:
+        while True:
+            if getter is None:
+                if ended.is_set() and queue.empty():
+                    break
+                getter = asyncio.ensure_future(queue.get())
+            await asyncio.wait({getter, end}, timeout=flush_interval, return_when=asyncio.FIRST_COMPLETED)
+            batch = []
+            if getter.done():
+                batch.append(getter.result())
+                getter = None
+            elif ended.is_set() and queue.empty():
+                break
+            # take what is already waiting, up to batch_size
+            while batch and len(batch) < batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            await loop.run_in_executor(executor, convert, batch, False)
+        await producer
+        await loop.run_in_executor(executor, convert, [], True)
+        await loop.run_in_executor(executor, writer.close)
+    finally:
+        for task in (producer, end, getter):
+            if task is not None:
+                task.cancel()
+        # a conversion may still be running after cancellation, close the file after it in the
+        # worker thread instead of blocking the event loop
+        executor.submit(writer.close)
+        executor.shutdown(wait=False)
+    record_stats(stats, ass, timer)
+    return writer.filenames
@@ -1,18 +1,24 @@
 import io
+import os
 import re
-import json
+import threading
 import xml.etree.ElementTree as ET
+from bisect import bisect_right
 from datetime import datetime
 from functools import lru_cache
+from types import MappingProxyType
 from .ass import Ass
-from .protobuf.niconico import NNDCommentProto
-from typing import Union, Optional
+from .compression import decompressed, detect_compression, is_compressed_file, open_input
+from .jsonstream import iter_thread_comments
+from .output import OutputTarget, write_output
+from .profile import PhaseTimer, record_stats
+from typing import Any, Dict, Iterator, Mapping, NamedTuple, Union, Optional, Sequence, Tuple, List
 
 __all__ = ['proto2ass', 'json2ass', 'xml2ass']
 
 
 def proto2ass(
-        proto_file: Union[bytes, io.IOBase],
+        proto_file: Union[str, os.PathLike, bytes, io.IOBase],
         width: int,
         height: int,
         reserve_blank: int = 0,
@@ -21,39 +27,44 @@ def proto2ass(
         alpha: float = 1.0,
         duration_marquee: float = 5.0,
         duration_still: float = 5.0,
-        comment_filter: str = "",
+        comment_filter: Union[str, Sequence[str]] = "",
         reduced: bool = False,
         bold: bool = False,
         live: bool = False,
-        out_filename: str = "",
-) -> Optional[str]:
+        out_filename: Optional[OutputTarget] = "",
+        stats: Optional[dict] = None,
+        sizes: Optional[Sequence[Tuple[int, int]]] = None,
+        compress: Optional[bool] = None,
+        merge_window: float = 0.0,
+        merge_style: str = "count",
+        max_per_second: int = 0,
+        max_on_screen: int = 0,
+) -> Union[None, str, List[str]]:
+    timer = PhaseTimer()
+    mail_cache = mail_cache_info()
     ass = Ass(width, height, reserve_blank, font_face, font_size, alpha, duration_marquee,
               duration_still, comment_filter, reduced, bold, live)
-    if isinstance(proto_file, bytes):
-        proto_file = io.BytesIO(proto_file)
-    comment = NNDCommentProto()
-    while True:
-        size = int.from_bytes(proto_file.read(4), byteorder='big', signed=False)
-        if size == 0:
-            break
-        comment_serialized = proto_file.read(size)
-        comment.ParseFromString(comment_serialized)
-        pool = 1 if comment.fork == "owner" else 0
-        style = {"pos": 0, "size": 1, "color": 0xFFFFFF, "font": "defont"}
-        style, commands = process_mailstyle(comment.mail, style)
-        pos, color, size = style["pos"], style["color"], style["size"]
-        ass.add_comment(
-            comment.vpos / 100,
-            comment.date,
-            comment.content,
-            size,
-            pos,
-            color,
-            pool,
-        )
-    if out_filename:
-        return ass.write_to_file(out_filename)
-    return ass.to_string()
+    ass.merge_window, ass.merge_style = merge_window, merge_style
+    ass.max_per_second, ass.max_on_screen = max_per_second, max_on_screen
+    # NNDComment stream is framed and decoded natively, compressed inputs are decompressed while they are read
+    if isinstance(proto_file, (str, os.PathLike)):
+        if is_compressed_file(proto_file):
+            with open_input(proto_file) as f:
+                ass.add_niconico_reader(f, mail_style)
+        else:
+            ass.add_niconico_file(os.fspath(proto_file), mail_style)
+    elif isinstance(proto_file, io.IOBase):
+        ass.add_niconico_reader(decompressed(proto_file), mail_style)
+    elif detect_compression(proto_file[:2]):
+        ass.add_niconico_reader(decompressed(io.BytesIO(proto_file)), mail_style)
+    else:
+        ass.add_niconico_stream(proto_file, mail_style)
+    timer.lap("comments")
+    result = write_output(ass, out_filename, sizes, compress)
+    timer.lap("output")
+    record_stats(stats, ass, timer)
+    record_mail_cache(stats, mail_cache)
+    return result
 
 
 def json2ass(
@@ -66,77 +77,40 @@ def json2ass(
         alpha: float = 1.0,
         duration_marquee: float = 5.0,
         duration_still: float = 5.0,
-        comment_filter: str = "",
+        comment_filter: Union[str, Sequence[str]] = "",
         reduced: bool = False,
         bold: bool = False,
         live: bool = False,
-        out_filename: str = "",
-) -> Optional[str]:
+        out_filename: Optional[OutputTarget] = "",
+        stats: Optional[dict] = None,
+        sizes: Optional[Sequence[Tuple[int, int]]] = None,
+        compress: Optional[bool] = None,
+        merge_window: float = 0.0,
+        merge_style: str = "count",
+        max_per_second: int = 0,
+        max_on_screen: int = 0,
+) -> Union[None, str, List[str]]:
+    timer = PhaseTimer()
+    mail_cache = mail_cache_info()
     ass = Ass(width, height, reserve_blank, font_face, font_size, alpha, duration_marquee,
               duration_still, comment_filter, reduced, bold, live)
-    if isinstance(json_file, (str, bytes)):
-        data = json.loads(json_file)
-    else:
-        data = json.load(json_file)
-    frk = None
-    if isinstance(data, dict):
-        for key in ["data", "threads", "comments"]:
-            if key in data:
-                if key == "comments":
-                    frk = data.get("fork", "")
-                data = data[key]
-    if frk is not None:
-        commentlist = {frk: data}
-    elif data and data[0].get("comments") is not None:
-        commentlist = {}
-        for cmt in data:
-            if comments := cmt["comments"]:
-                commentlist.setdefault(cmt.get("fork", ""), []).extend(comments)
-    else:
-        commentlist = {"": data}
-    for f, comments in commentlist.items():
-        if f == "owner":
-            comments.sort(key=lambda c: c["vposMs"])
-            pool = 1
-        else:
-            pool = 0
-        for comment in comments:
-            fork = f
-            vpos = comment["vposMs"] / 1000
-            text = comment["body"]
-            unixdate = datetime.fromisoformat(comment["postedAt"]).timestamp()
-            mail = comment["commands"]
-            style = {"pos": 0, "size": 1, "color": 0xFFFFFF, "font": "defont"}
-            if text.startswith(('@', '＠', '/')) and fork == "owner":
-                style, commands = process_mailstyle(mail, style)
-                dr = commands.get("duration", 30)
-                parse_nicoscript(text, vpos, dr, style)
-                continue
-            text, style = process_nicoscript(text, style, vpos, fork)
-            style, commands = process_mailstyle(mail, style)
-            if commands.get("invisible"):
-                continue
-            pos, color, size = style["pos"], style["color"], style["size"]
-            dr = commands.get("duration") or (duration_still if pos in [1, 2] else duration_marquee)
-            alpha_factor = style["alpha"]
-            font = style["font"]
-            ass.add_nico_comment(
-                vpos,
-                dr,
-                int(unixdate),
-                text,
-                size,
-                pos,
-                color,
-                alpha_factor,
-                font,
-                pool,
-                live or commands["full"],
-                commands["ender"]
-            )
-    if out_filename:
-        return ass.write_to_file(out_filename)
-    return ass.to_string()
+    ass.merge_window, ass.merge_style = merge_window, merge_style
+    ass.max_per_second, ass.max_on_screen = max_per_second, max_on_screen
+    if isinstance(json_file, bytes) and detect_compression(json_file[:2]):
+        json_file = io.BytesIO(json_file)
+    if not isinstance(json_file, (str, bytes)):
+        json_file = decompressed(json_file)
+    scripts = NicoScriptEngine()
+    # comments are decoded one at a time while the file is read
+    for fork, comment in iter_thread_comments(json_file):
+        add_chat(ass, scripts, comment["vposMs"] / 1000, parse_posted_at(comment["postedAt"]), comment["body"],
+                 comment["commands"], fork, duration_marquee, duration_still, live)
+    timer.lap("comments")
+    result = write_output(ass, out_filename, sizes, compress)
+    timer.lap("output")
+    record_stats(stats, ass, timer)
+    record_mail_cache(stats, mail_cache)
+    return result
 
 
 def xml2ass(
@@ -149,68 +123,151 @@ def xml2ass(
         alpha: float = 1.0,
         duration_marquee: float = 5.0,
         duration_still: float = 5.0,
-        comment_filter: str = "",
+        comment_filter: Union[str, Sequence[str]] = "",
         reduced: bool = False,
         bold: bool = False,
         live: bool = False,
-        out_filename: str = "",
-) -> Optional[str]:
+        out_filename: Optional[OutputTarget] = "",
+        stats: Optional[dict] = None,
+        sizes: Optional[Sequence[Tuple[int, int]]] = None,
+        compress: Optional[bool] = None,
+        merge_window: float = 0.0,
+        merge_style: str = "count",
+        max_per_second: int = 0,
+        max_on_screen: int = 0,
+) -> Union[None, str, List[str]]:
+    timer = PhaseTimer()
+    mail_cache = mail_cache_info()
     ass = Ass(width, height, reserve_blank, font_face, font_size, alpha, duration_marquee,
               duration_still, comment_filter, reduced, bold, live)
-    if isinstance(xml_file, (str, bytes)):
-        root = ET.fromstring(xml_file)
+    ass.merge_window, ass.merge_style = merge_window, merge_style
+    ass.max_per_second, ass.max_on_screen = max_per_second, max_on_screen
+    if isinstance(xml_file, bytes) and detect_compression(xml_file[:2]):
+        xml_file = io.BytesIO(xml_file)
+    if isinstance(xml_file, str):
+        xml_file = io.StringIO(xml_file)
+    elif isinstance(xml_file, bytes):
+        xml_file = io.BytesIO(xml_file)
     else:
-        root = ET.parse(xml_file).getroot()
-    for chat in root.findall("chat"):
-        fork = chat.get("fork", "")
-        pool = 1 if fork == "owner" else 0
-        vpos = int(chat.get("vpos")) / 100
-        date = int(chat.get("date"))
-        mail = chat.get("mail", '')
-        text = chat.text or ''
-        style = {"pos": 0, "size": 1, "color": 0xFFFFFF, "font": "defont"}
-        if text.startswith(('@', '＠', '/')) and fork == "owner":
-            style, commands = process_mailstyle(mail, style)
-            dr = commands.get("duration", 30)
-            parse_nicoscript(text, vpos, dr, style)
+        xml_file = decompressed(xml_file)
+    scripts = NicoScriptEngine()
+    for chat in iter_chats(xml_file):
+        add_chat(ass, scripts, int(chat.get("vpos")) / 100, int(chat.get("date")), chat.text or '',
+                 chat.get("mail", ''), chat.get("fork", ""), duration_marquee, duration_still, live)
+    timer.lap("comments")
+    result = write_output(ass, out_filename, sizes, compress)
+    timer.lap("output")
+    record_stats(stats, ass, timer)
+    record_mail_cache(stats, mail_cache)
+    return result
+
+
+def iter_chats(xml_file: io.IOBase) -> Iterator[ET.Element]:
+    """yield the <chat> children of the root element while the file is parsed, each element is
+    cleared once the next one is read so memory does not grow with the file"""
+    events = ET.iterparse(xml_file, events=("start", "end"))
+    _, root = next(events)
+    depth = 1
+    for event, elem in events:
+        if event == "start":
+            depth += 1
             continue
-        text, style = process_nicoscript(text, style, vpos, fork)
+        depth -= 1
+        if depth == 1:
+            if elem.tag == "chat":
+                yield elem
+            root.clear()
+
+
+_posted_seconds: Dict[str, int] = {}
+
+
+def parse_posted_at(posted_at: str) -> int:
+    """unix time of a postedAt ("2023-01-02T03:04:05+09:00"), cached by the string as busy
+    threads have many comments posted in the same second"""
+    seconds = _posted_seconds.get(posted_at)
+    if seconds is None:
+        if len(_posted_seconds) >= 4096:
+            _posted_seconds.clear()
+        seconds = _posted_seconds[posted_at] = int(datetime.fromisoformat(posted_at).timestamp())
+    return seconds
+
+
+def add_chat(ass: Ass, scripts: "NicoScriptEngine", vpos: float, date: int, text: str, mail: Union[str, list],
+             fork: str, duration_marquee: float = 5.0, duration_still: float = 5.0, live: bool = False) -> bool:
+    """apply the mail commands and nicoscript to a comment and add it to `ass`, owner nicoscript
+    comments are registered instead, return True if a comment was added"""
+    style = {"pos": 0, "size": 1, "color": 0xFFFFFF, "font": "defont"}
+    if text.startswith(('@', '＠', '/')) and fork == "owner":
         style, commands = process_mailstyle(mail, style)
-        if commands.get("invisible"):
-            continue
-        pos, color, size = style["pos"], style["color"], style["size"]
-        dr = commands.get("duration") or (duration_still if pos in [1, 2] else duration_marquee)
-        alpha_factor = style["alpha"]
-        font = style["font"]
-        ass.add_nico_comment(
-            vpos,
-            dr,
-            date,
-            text,
-            size,
-            pos,
-            color,
-            alpha_factor,
-            font,
-            pool,
-            live or commands["full"],
-            commands["ender"]
-        )
-    if out_filename:
-        return ass.write_to_file(out_filename)
-    return ass.to_string()
+        dr = commands.get("duration", 30)
+        scripts.add(text, vpos, dr, style)
+        return False
+    text, style = scripts.apply(text, style, vpos, fork)
+    style, commands = process_mailstyle(mail, style)
+    if commands.get("invisible"):
+        return False
+    pos, color, size = style["pos"], style["color"], style["size"]
+    dr = commands.get("duration") or (duration_still if pos in [1, 2] else duration_marquee)
+    return ass.add_nico_comment(
+        vpos,
+        dr,
+        date,
+        text,
+        size,
+        pos,
+        color,
+        style["alpha"],
+        style["font"],
+        1 if fork == "owner" else 0,
+        live or commands["full"],
+        commands["ender"]
+    )
 
 
-def process_mailstyle(mail: Union[str, list], style: dict):
+def mail_style(mail: str):
+    """resolve a mail string to (pos, size, color) for comments without nicoscript"""
+    style = {"pos": 0, "size": 1, "color": 0xFFFFFF, "font": "defont"}
+    style, commands = process_mailstyle(mail, style)
+    return style["pos"], style["size"], style["color"]
+
+
+class MailCommands(NamedTuple):
+    """a mail string resolved once, the style fields it sets (None keeps the current value) and its
+    other commands"""
+    pos: Optional[int]
+    pos_reversed: Optional[int]  # pos of a comment reversed (pos 3) by nicoscript, which naka does not reset
+    size: Optional[float]
+    color: Optional[int]
+    font: Optional[str]
+    alpha: float
+    commands: Mapping[str, Any]
+
+
+class MailCounter(threading.local):
+    """compiled mail lookups and cache misses of the calling thread, a conversion runs on one thread
+    so concurrent conversions do not count each other's lookups"""
+    lookups = 0
+    misses = 0
+
+
+mail_counter = MailCounter()
+
+
+@lru_cache(maxsize=4096)
+def compile_mail(mail: Union[str, Tuple[str, ...]]) -> MailCommands:
+    mail_counter.misses += 1
+    style = {"pos": None, "size": None, "color": None, "font": None}
+    pos_reversed = 3
     commands = {k: False for k in OTHERS}
     if isinstance(mail, str):
         mail = mail.split()
     # only the first command of each type is used, see https://qa.nicovideo.jp/faq/show/6167
     for mailstyle in (m.lower() for m in reversed(mail)):
         if mailstyle in POS_MAPPING:
-            if style["pos"] == 3 and mailstyle == 'naka':
-                continue
             style["pos"] = POS_MAPPING[mailstyle]
+            if pos_reversed != 3 or mailstyle != 'naka':
+                pos_reversed = POS_MAPPING[mailstyle]
         elif mailstyle in SIZE_MAPPING:
             style["size"] = SIZE_MAPPING[mailstyle]
         elif mailstyle in NICONICO_COLOR_MAPPINGS:
@@ -223,8 +280,45 @@ def process_mailstyle(mail: Union[str, list], style: dict):
             commands[mailstyle] = True
         elif match := DURATION_REGEX.match(mailstyle):
             commands["duration"] = float(match.group(2) or match.group(4))
-    style["alpha"] = 0.5 if commands.get("_live") or commands.get("translucent") else 1
-    return style, commands
+    alpha = 0.5 if commands.get("_live") or commands.get("translucent") else 1
+    return MailCommands(style["pos"], None if pos_reversed == 3 else pos_reversed, style["size"], style["color"],
+                        style["font"], alpha, MappingProxyType(commands))
+
+
+def process_mailstyle(mail: Union[str, list], style: dict):
+    """apply the commands of `mail` to `style`, return it and the read-only other commands"""
+    mail_counter.lookups += 1
+    compiled = compile_mail(mail if isinstance(mail, str) else tuple(mail))
+    pos = compiled.pos_reversed if style["pos"] == 3 else compiled.pos
+    if pos is not None:
+        style["pos"] = pos
+    if compiled.size is not None:
+        style["size"] = compiled.size
+    if compiled.color is not None:
+        style["color"] = compiled.color
+    if compiled.font is not None:
+        style["font"] = compiled.font
+    style["alpha"] = compiled.alpha
+    return style, compiled.commands
+
+
+def mail_cache_info(since: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """hits and misses of the compiled mail lookups on the calling thread, from the snapshot `since`
+    if given, and the size of the cache shared by the converters"""
+    info = compile_mail.cache_info()
+    misses = mail_counter.misses
+    hits = mail_counter.lookups - misses
+    if since is not None:
+        hits, misses = hits - since["hits"], misses - since["misses"]
+    lookups = hits + misses
+    return {"hits": hits, "misses": misses, "size": info.currsize, "maxsize": info.maxsize,
+            "hit_rate": hits / lookups if lookups else 0.0}
+
+
+def record_mail_cache(stats: Optional[dict], since: Dict[str, Any]):
+    """record the mail cache lookups of one conversion, started at the snapshot `since`"""
+    if stats is not None:
+        stats["mail_cache"] = mail_cache_info(since)
 
 
 # https://dic.nicovideo.jp/a/コマンド
@@ -337,15 +431,14 @@ FUNC_PARAMS = {
             },
         }
 
-scripts = []
-def parse_nicoscript(text: str, vpos: float, dr: float, style: dict):
+def parse_nicoscript(text: str, vpos: float, dr: float, style: dict) -> Optional[dict]:
     text = text.replace(r'\n', '\n').replace(r'\t', '\t')
     match = NAME_PATTERN.match(text.strip())
     if not match:
-        return
+        return None
     func_name = match.group(1)
     if func_name not in FUNC_PARAMS:
-        return
+        return None
     params = FUNC_PARAMS[func_name]
     result = {key: param.get("default") for key, param in params.items()}
     if match.group(2):
@@ -364,7 +457,8 @@ def parse_nicoscript(text: str, vpos: float, dr: float, style: dict):
     result["style"] = style
     result["start"] = vpos
     result["end"] = vpos + dr
-    scripts.append(result)
+    return result
+
 
 @lru_cache(maxsize=None)
 def is_target(target: str, fork: str):
@@ -376,23 +470,89 @@ def is_target(target: str, fork: str):
         return True
     return False
 
-def process_nicoscript(text: str, style: dict, vpos: float, fork: str):
-    for s in (s for s in scripts if s["start"] <= vpos <= s["end"]):
-        if s["func_name"] == "デフォルト":
-            if style != s["style"]:
-                style = s["style"].copy()
-        elif is_target(s["target"], fork):
-            if s["func_name"] == "置換":
-                keyword = s["keyword"]
-                replacement = s["replacement"]
-                if (
-                    (s["condition"] == '部分一致' and keyword in text) or
-                    (s["condition"] == '完全一致' and keyword == text)
-                ):
-                    text = text.replace(keyword, replacement) if s["range"] == '単' else replacement
-                    if style != s["style"]:
-                        style = s["style"].copy()
-            elif s["func_name"] == "逆":
-                style["pos"] = 3
-                # todo: calculations when the comment doesn’t always fly l-to-r
-    return text, style
+
+class ScriptIndex:
+    """Static index of scripts by time interval: a sweep over their sorted bounds records the scripts
+    active at each bound and up to the next one, so a lookup is a bisect. Scripts are (seq, script)
+    pairs sorted by seq."""
+
+    def __init__(self, scripts: List[Tuple[int, dict]]):
+        self.scripts = scripts
+        starts = sorted(scripts, key=lambda s: s[1]["start"])
+        ends = sorted(scripts, key=lambda s: s[1]["end"])
+        self.bounds: List[float] = sorted({s["start"] for _, s in scripts} | {s["end"] for _, s in scripts})
+        self.at: List[Tuple[Tuple[int, dict], ...]] = []     # active at bounds[i]
+        self.after: List[Tuple[Tuple[int, dict], ...]] = []  # active between bounds[i] and bounds[i + 1]
+        active: Dict[int, dict] = {}
+        si = ei = 0
+        for bound in self.bounds:
+            while si < len(starts) and starts[si][1]["start"] == bound:
+                active[starts[si][0]] = starts[si][1]
+                si += 1
+            at = tuple(sorted(active.items()))
+            ended = ei
+            while ei < len(ends) and ends[ei][1]["end"] == bound:
+                del active[ends[ei][0]]
+                ei += 1
+            self.at.append(at)
+            self.after.append(at if ei == ended else tuple(sorted(active.items())))
+
+    def __len__(self) -> int:
+        return len(self.scripts)
+
+    def active(self, vpos: float) -> Tuple[Tuple[int, dict], ...]:
+        i = bisect_right(self.bounds, vpos) - 1
+        if i < 0:
+            return ()
+        return self.at[i] if self.bounds[i] == vpos else self.after[i]
+
+
+class NicoScriptEngine:
+    """Owner nicoscript of one conversion. A script applies to the comments added after it within
+    [start, end], in the order the scripts were added. Scripts are kept in static interval indexes
+    of decreasing power of two sizes: a new script is an index of its own and two indexes of the
+    same size are merged, so a comment only looks at a bisect in O(log n) indexes and the scripts
+    active at its vpos."""
+
+    def __init__(self):
+        self.scripts: List[dict] = []
+        self.indexes: List[ScriptIndex] = []
+
+    def add(self, text: str, vpos: float, dr: float, style: dict) -> bool:
+        script = parse_nicoscript(text, vpos, dr, style)
+        if script is None:
+            return False
+        index = ScriptIndex([(len(self.scripts), script)])
+        self.scripts.append(script)
+        while self.indexes and len(self.indexes[-1]) == len(index):
+            index = ScriptIndex(self.indexes.pop().scripts + index.scripts)
+        self.indexes.append(index)
+        return True
+
+    def active(self, vpos: float) -> List[dict]:
+        """the scripts active at vpos in the order they were added"""
+        # indexes hold consecutive runs of scripts, the older ones first
+        return [s for index in self.indexes for _, s in index.active(vpos)]
+
+    def apply(self, text: str, style: dict, vpos: float, fork: str):
+        if not self.scripts:
+            return text, style
+        for s in self.active(vpos):
+            if s["func_name"] == "デフォルト":
+                if style != s["style"]:
+                    style = s["style"].copy()
+            elif is_target(s["target"], fork):
+                if s["func_name"] == "置換":
+                    keyword = s["keyword"]
+                    replacement = s["replacement"]
+                    if (
+                        (s["condition"] == '部分一致' and keyword in text) or
+                        (s["condition"] == '完全一致' and keyword == text)
+                    ):
+                        text = text.replace(keyword, replacement) if s["range"] == '単' else replacement
+                        if style != s["style"]:
+                            style = s["style"].copy()
+                elif s["func_name"] == "逆":
+                    style["pos"] = 3
+                    # todo: calculations when the comment doesn’t always fly l-to-r
+        return text, style
@@ -0,0 +1,82 @@
+import gzip
+import io
+import os
+from typing import BinaryIO, List, Optional, Sequence, TextIO, Tuple, Union
+from .ass import Ass
+
+__all__ = ['size_filename', 'write_ass', 'write_output']
+
+OutputTarget = Union[str, os.PathLike, int, BinaryIO, TextIO]
+
+
+def size_filename(out_filename: str, width: int, height: int) -> str:
+    """output filename of one stage size, `{width}` and `{height}` in out_filename are replaced,
+    otherwise the size is appended to the file stem: a.ass -> a_1280x720.ass"""
+    if "{width}" in out_filename or "{height}" in out_filename:
+        return out_filename.replace("{width}", str(width)).replace("{height}", str(height))
+    stem, ext = os.path.splitext(out_filename)
+    if ext == ".gz":
+        stem, inner = os.path.splitext(stem)
+        ext = inner + ext
+    return f"{stem}_{width}x{height}{ext}"
+
+
+def _write_chunks(ass: Ass, f: Union[BinaryIO, TextIO], compress: bool, chunk_size: int, width: int = 0,
+                  height: int = 0):
+    if compress:
+        with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+            for chunk in ass.iter_chunks(chunk_size, width, height):
+                gz.write(chunk)
+        return
+    # chunks end at line boundaries, so each of them decodes on its own
+    text = isinstance(f, io.TextIOBase)
+    for chunk in ass.iter_chunks(chunk_size, width, height):
+        f.write(chunk.decode('utf8') if text else chunk)
+
+
+def write_ass(ass: Ass, target: OutputTarget, compress: Optional[bool] = None, chunk_size: int = 1 << 20):
+    """write the ass text to a path, a file descriptor or a writable file object in blocks of chunk_size
+    bytes, gzip compressed if compress is True (by default when a path ends with .gz). File descriptors
+    and file objects are left open."""
+    if isinstance(target, (str, os.PathLike)):
+        target = os.fspath(target)
+        if compress is None:
+            compress = target.endswith(".gz")
+        if not compress:
+            # plain files are written natively without the GIL
+            return ass.write_to_file(target)
+        with open(target, 'wb') as f:
+            return _write_chunks(ass, f, True, chunk_size)
+    if isinstance(target, int):
+        with open(target, 'wb', closefd=False) as f:
+            return _write_chunks(ass, f, bool(compress), chunk_size)
+    return _write_chunks(ass, target, bool(compress), chunk_size)
+
+
+def write_output(
+        ass: Ass,
+        out_filename: Optional[OutputTarget] = "",
+        sizes: Optional[Sequence[Tuple[int, int]]] = None,
+        compress: Optional[bool] = None,
+) -> Union[None, str, List[str]]:
+    """write or return the ass of a converter, once for each of `sizes` if given"""
+    has_output = out_filename is not None and out_filename != ""
+    if not sizes:
+        if has_output:
+            return write_ass(ass, out_filename, compress)
+        return ass.to_string()
+    if not has_output:
+        return ass.to_strings([tuple(size) for size in sizes])
+    if not isinstance(out_filename, (str, os.PathLike)):
+        raise ValueError("several sizes need an output filename")
+    out_filename = os.fspath(out_filename)
+    if compress is None:
+        compress = out_filename.endswith(".gz")
+    for width, height in sizes:
+        filename = size_filename(out_filename, width, height)
+        if compress:
+            with open(filename, 'wb') as f:
+                _write_chunks(ass, f, True, 1 << 20, width, height)
+        else:
+            ass.render_to_file(width, height, filename)
+    return None
@@ -0,0 +1,46 @@
+import time
+from typing import Dict, Optional
+from .ass import Ass
+
+__all__ = ['PhaseTimer', 'record_stats', 'format_stats']
+
+
+class PhaseTimer:
+    """wall time of the Python side phases of a converter in seconds, each lap ends a phase"""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.last = time.perf_counter()
+
+    def lap(self, name: str):
+        now = time.perf_counter()
+        self.phases[name] = self.phases.get(name, 0) + now - self.last
+        self.last = now
+
+
+def record_stats(stats: Optional[dict], ass: Ass, timer: PhaseTimer):
+    """fill the `stats` dict of a converter: filter drops, Python phases and Ass.stats()"""
+    if stats is None:
+        return
+    stats["filters"] = ass.filter_stats()
+    stats["parser"] = timer.phases
+    stats["ass"] = ass.stats()
+
+
+def format_stats(stats: dict) -> str:
+    """human readable profile of a conversion from the `stats` dict of a converter"""
+    lines = ["parser (python):"]
+    lines += [f"  {name:<17}{seconds * 1000:10.2f} ms" for name, seconds in stats["parser"].items()]
+    ass = stats["ass"]
+    lines.append("ass (c++):")
+    lines += [f"  {name:<17}{seconds * 1000:10.2f} ms" for name, seconds in ass["phases"].items()]
+    comments = ass["comments"]
+    lines.append(f"comments: added {comments['added']}, filtered {comments['filtered']}")
+    lines.append("  by mode: " + ", ".join(f"{k}: {v}" for k, v in comments["by_mode"].items()))
+    lines.append("  by pool: " + ", ".join(f"{k}: {v}" for k, v in comments["by_pool"].items()))
+    lines.append("layout: " + ", ".join(f"{k} {v}" for k, v in ass["layout"].items()))
+    lines.append("memory: " + ", ".join(f"{k} {v / 2 ** 20:.2f} MiB" for k, v in ass["memory"].items()))
+    if "mail_cache" in stats:
+        cache = stats["mail_cache"]
+        lines.append(f"mail cache: hit rate {cache['hit_rate']:.1%}, {cache['size']}/{cache['maxsize']} entries")
+    return "\n".join(lines)
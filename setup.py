@@ -47,7 +47,7 @@ setup(
     ],
     author="HFrost0, m13253, Nyakku Shigure",
     license="GPLv3",
-    packages=find_packages(exclude=['tests', 'danmaku_old']),
+    packages=find_packages(exclude=['tests', 'danmaku_old', 'benchmarks', 'benchmarks.*']),
     package_data={'danmakuC': ["*.pyi"]},
     ext_modules=ext_modules,
     cmdclass={"build_ext": build_ext},
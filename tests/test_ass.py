@@ -0,0 +1,177 @@
+import re
+from danmakuC.ass import Ass
+
+
+def new_ass(width: int = 1920, height: int = 1080, reduced: bool = False) -> Ass:
+    return Ass(width, height, 0, "sans-serif", 25.0, 1.0, 5.0, 5.0, "", reduced, False, False)
+
+
+def rows_of(text: str) -> list:
+    return [int(m) for m in re.findall(r'\\(?:pos|move)\(\S+, (\d+)', text)]
+
+
+def test_still_rows_stack_and_release():
+    ass = new_ass()
+    for progress in [0, 0.5, 1, 4.95, 5.2]:
+        ass.add_comment(progress, 0, "still", 1, 1, 0xFFFFFF, 0)
+    # the first row is released 0.1s before the first comment ends
+    assert rows_of(ass.to_string()) == [0, 25, 50, 0, 75]
+
+
+def test_full_stage_alternative_row():
+    ass = new_ass(height=100)
+    for i in range(6):
+        ass.add_comment(i * 0.01, i, "marquee", 1, 0, 0xFFFFFF, 0)
+    assert rows_of(ass.to_string()) == [0, 25, 50, 75, 0, 25]
+    ass = new_ass(height=100, reduced=True)
+    for i in range(6):
+        ass.add_comment(i * 0.01, i, "marquee", 1, 0, 0xFFFFFF, 0)
+    assert rows_of(ass.to_string()) == [0, 25, 50, 75]
+
+
+def test_filter_rules():
+    ass = Ass(1920, 1080, 0, "sans-serif", 25.0, 1.0, 5.0, 5.0, ["awsl", "^23+$", "(哈){3}"], False, False, False)
+    ass.add_keyword_filters(["a.b"])
+    for content in ["awsl!", "2333", "12333", "哈哈哈", "哈哈", "a.b", "acb"]:
+        ass.add_comment(0, 0, content, 1, 0, 0xFFFFFF, 0)
+    assert ass.filter_stats() == {"awsl": 1, "^23+$": 1, "(哈){3}": 1, "a.b": 1}
+    assert len(rows_of(ass.to_string())) == 3
+
+
+def test_buffer_and_chunks():
+    ass = new_ass(height=100)
+    for i in range(50):
+        ass.add_comment(i * 0.3, i, f"comment {i}", 1, i % 3, 0xFFFFFF, 0)
+    text = ass.to_string().encode()
+    assert bytes(memoryview(ass.to_buffer())) == text
+    chunks = list(ass.iter_chunks(256))
+    assert b"".join(chunks) == text
+    assert len(chunks) > 1 and all(len(c) >= 256 for c in chunks[:-1])
+    # a sized iteration lays out like render and restores the stage size afterwards
+    assert b"".join(ass.iter_chunks(256, 1280, 720)).decode() == ass.render(1280, 720)
+    assert ass.to_string().encode() == text
+    chunks = ass.iter_chunks(256)
+    next(chunks)
+    ass.add_comment(0, 0, "late", 1, 0, 0xFFFFFF, 0)
+    try:
+        next(chunks)
+    except RuntimeError:
+        pass
+    else:
+        assert False, "adding comments during iteration should raise"
+
+
+def test_display_width():
+    ass = new_ass()
+    texts = ["2333", "哈哈哈", "草wwww", "😀👍", "e\u0301", "ｱｲｳ", "ＡＢ", "a\nbb"]
+    for i, text in enumerate(texts):
+        ass.add_comment(i * 10, 0, text, 1, 0, 0xFFFFFF, 0)
+    # \move ends at -(widest line in em * font size)
+    ends = re.findall(r'\\move\(\S+, \d+, (\S+), \d+\)', ass.to_string())
+    assert [float(end) for end in ends] == [-50, -75, -75, -50, -12.5, -37.5, -50, -25]
+
+
+def test_escape_text():
+    ass = new_ass()
+    ass.add_comment(0, 0, "a\\b{c}\td\ne", 1, 1, 0xFFFFFF, 0)
+    zwsp, fwsp = "\u200b", "\u3000"
+    expected = f"{zwsp}a\\{zwsp}b\\{{c\\}}{fwsp}{fwsp}d{zwsp}\\N{zwsp}e{zwsp}"
+    assert ass.to_string().endswith("}" + expected + "\n")
+
+
+def test_stats():
+    ass = new_ass(height=100, reduced=True)
+    ass.add_filters(["skip"])
+    for i in range(6):
+        ass.add_comment(i * 0.01, i, "marquee", 1, 0, 0xFFFFFF, i % 2)
+    ass.add_comment(0, 0, "skip", 1, 0, 0xFFFFFF, 0)
+    ass.add_comment(0, 0, "still", 1, 1, 0xFFFFFF, 0)
+    ass.to_string()
+    stats = ass.stats()
+    assert stats["comments"] == {"added": 7, "filtered": 1, "by_mode": {0: 6, 1: 1}, "by_pool": {0: 4, 1: 3}}
+    assert stats["layout"]["laid_out"] == 7
+    assert stats["layout"]["collisions"] == 0
+    assert set(stats["phases"]) == {"decode", "sort", "layout", "format"}
+    for i in range(6):
+        ass.add_comment(i * 0.01, i, "marquee", 1, 0, 0xFFFFFF, 0)
+    ass.to_string()
+    stats = ass.stats()["layout"]
+    assert stats["collisions"] == stats["dropped_reduced"] == 5
+
+
+def test_flush():
+    ass, whole = new_ass(height=200), new_ass(height=200)
+    body = ""
+    for i in range(300):
+        for a in (ass, whole):
+            a.add_comment(i * 0.05, i, f"comment {i}", 1, i % 3, 0xFFFFFF, 0)
+        if i % 37 == 0:
+            body += ass.flush()
+    body += ass.flush(final=True)
+    assert ass.header + body == whole.to_string()
+    assert ass.flush() == ""
+
+    ass = new_ass()
+    ass.reorder_window = 2
+    for progress in [0, 1, 3, 2.5, 5]:
+        ass.add_comment(progress, 0, str(progress), 1, 0, 0xFFFFFF, 0)
+    # 3 is within the window of 5 and the late 2.5 is sorted before it
+    assert re.findall('\u200b(\\S+)\u200b', ass.flush()) == ["0", "1", "2.5", "3"]
+    assert re.findall('\u200b(\\S+)\u200b', ass.flush(final=True)) == ["5"]
+    assert ass.stats()["layout"]["late"] == 0
+
+
+def test_merge_repeats():
+    ass = new_ass()
+    for i in range(10):
+        ass.add_comment(i * 0.5, i, "awsl", 1, 0, 0xFFFFFF, 0)
+    ass.add_comment(1, 0, "awsl", 1, 1, 0xFFFFFF, 0)  # another stage
+    ass.add_comment(2, 0, "233", 1, 0, 0xFFFFFF, 0)
+    whole = ass.to_string()
+    ass.merge_window = 3
+    text = ass.to_string()
+    # 0..2.5s and 3..4.5s are two groups
+    assert re.findall('\u200b(\\S+)\u200b( ×\\d+)?\n', text) == [
+        ("awsl", " ×6"), ("awsl", ""), ("233", ""), ("awsl", " ×4")]
+    assert ass.stats()["layout"]["merged"] == 8
+    ass.merge_style = "scale"
+    assert "\\fs" in ass.to_string() and "×" not in ass.to_string()
+    ass.merge_window = 0
+    assert ass.to_string() == whole
+
+
+def test_density_cap():
+    ass = new_ass()
+    ass.max_per_second = 2
+    for i, (weight, attr) in enumerate([(1, 0), (9, 0), (1, 4), (5, 0)]):
+        ass.add_comment(0.1 * i, i, f"w{weight}a{attr}", 1, 0, 0xFFFFFF, 0, weight, attr)
+    ass.add_comment(1.5, 9, "next second", 1, 0, 0xFFFFFF, 0)
+    # the high-liked one and the heaviest one of the first second are kept
+    assert re.findall('\u200b(.+)\u200b', ass.to_string()) == ["w9a0", "w1a4", "next second"]
+    assert ass.stats()["layout"]["density_dropped"] == 2
+
+    ass = new_ass()
+    ass.max_on_screen = 2
+    for i, weight in enumerate([3, 2, 1, 5]):
+        ass.add_comment(i, i, f"w{weight}", 1, 1, 0xFFFFFF, 0, weight)
+    ass.add_comment(6, 9, "later", 1, 1, 0xFFFFFF, 0)
+    # w2 is dropped when w5 comes, w1 never fits, shown for 5s
+    assert re.findall('\u200b(.+)\u200b', ass.to_string()) == ["w3", "w5", "later"]
+
+
+def test_parallel_layout():
+    import random
+    rnd = random.Random(0)
+    comments = [(rnd.uniform(0, 600), i, "c" * rnd.randint(1, 30), rnd.choice([0.75, 1, 1.5]), rnd.choice([0, 0, 1, 2]),
+                 rnd.choice([0xFFFFFF, 0xFF0000]), rnd.choice([0, 0, 1])) for i in range(40000)]
+    outputs = []
+    for workers in [1, 4]:
+        ass = new_ass(reduced=True)
+        ass.workers = workers
+        for c in comments:
+            ass.add_comment(*c)
+        # rows of every (pool, mode) stage on their own thread, and more than one serialization chunk
+        outputs.append((ass.to_string(), b"".join(ass.iter_chunks()), {k: v for k, v in ass.stats().items()
+                                                                       if k in ("comments", "layout")}))
+    assert outputs[0] == outputs[1]
+    assert outputs[0][0].encode() == outputs[0][1]
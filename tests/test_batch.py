@@ -0,0 +1,48 @@
+import os
+import shutil
+from danmakuC import convert
+from danmakuC.batch import batch_convert
+
+file = os.path.join(os.path.dirname(__file__), 'test_dm.bin')
+
+
+def test_batch_skip_unchanged(tmp_path):
+    src = tmp_path / "src"
+    (src / "sub").mkdir(parents=True)
+    shutil.copy(file, src / "a.bin")
+    shutil.copy(file, src / "sub" / "b.bin")
+    out = tmp_path / "out"
+    result = batch_convert([src], out, max_workers=2, width=1280, height=720)
+    assert len(result["converted"]) == 2 and not result["skipped"]
+    assert (out / "sub" / "b.ass").read_text(encoding='utf8') == convert(file, 1280, 720)
+    # unchanged files and params
+    result = batch_convert([src], out, max_workers=2, width=1280, height=720)
+    assert len(result["skipped"]) == 2 and not result["converted"]
+    # changed params
+    result = batch_convert([str(src / "*.bin")], out, max_workers=2, width=1920, height=1080)
+    assert result["converted"] == [str(src / "a.bin")]
+
+
+def test_batch_inputs(tmp_path):
+    import gzip
+    src = tmp_path / "src"
+    src.mkdir()
+    shutil.copy(file, src / "a.bin")
+    (src / "a.json.gz").write_bytes(gzip.compress(b"[]"))
+    (src / "empty.xml").write_bytes(b"")
+    (src / "notes.txt").write_text("not comments")
+    (src / "__init__.py").write_text("")
+    out = tmp_path / "out"
+    result = batch_convert([src], out, max_workers=2)
+    # only comment files are taken, an empty one fails and is not written
+    assert sorted(result["converted"]) == [str(src / "a.bin"), str(src / "a.json.gz")]
+    assert result["failed"] == [str(src / "empty.xml")]
+    assert sorted(os.listdir(out)) == [".danmakuC-manifest.json", "a.bin.ass", "a.json.ass"]
+    # a.json and a.json.gz would both be written to a.json.ass
+    (src / "a.json").write_text("[]")
+    try:
+        batch_convert([src], out, max_workers=2)
+    except ValueError:
+        pass
+    else:
+        assert False, "colliding outputs should raise"
@@ -0,0 +1,68 @@
+import os
+from danmakuC.ass import Ass
+from danmakuC.bilibili import proto2ass
+from danmakuC.protobuf.bilibili import BiliCommentProto
+
+file = os.path.join(os.path.dirname(__file__), 'test_dm.bin')
+
+
+def python_proto2ass(content: bytes, width: int, height: int) -> str:
+    """reference conversion through the Python protobuf runtime"""
+    ass = Ass(width, height, 0, "sans-serif", 25.0, 1.0, 5.0, 5.0, "", False, False, False)
+    target = BiliCommentProto()
+    target.ParseFromString(content)
+    mode_map = {1: 0, 4: 2, 5: 1, 6: 3, 7: 4}
+    for elem in target.elems:
+        if elem.mode not in mode_map:
+            continue
+        try:
+            ass.add_comment(elem.progress / 1000, elem.ctime, elem.content, elem.fontsize / 25.0,
+                            mode_map[elem.mode], elem.color, elem.pool)
+        except TypeError:
+            continue
+    return ass.to_string()
+
+
+def test_native_segment_decoder():
+    with open(file, 'rb') as f:
+        content = f.read()
+    assert proto2ass(content, 1920, 1080) == python_proto2ass(content, 1920, 1080)
+
+
+def test_segment_skip_unsupported():
+    target = BiliCommentProto()
+    for mode, ctime, color in [(1, 1, 0xFFFFFF), (9, 1, 0xFFFFFF), (1, 1 << 40, 0xFFFFFF), (5, 1, 0xFFFFFFFF)]:
+        elem = target.elems.add()
+        elem.mode, elem.ctime, elem.color, elem.content, elem.fontsize = mode, ctime, color, "test", 25
+    ass = Ass(1920, 1080, 0, "sans-serif", 25.0, 1.0, 5.0, 5.0, "", False, False, False)
+    counts = ass.add_bilibili_segment(target.SerializeToString())
+    assert counts == {"parsed": 4, "added": 1, "filtered": 0, "skipped": 3}
+
+
+def test_compressed_segment():
+    import gzip
+    import io
+    import zlib
+    with open(file, 'rb') as f:
+        content = f.read()
+    expected = proto2ass(content, 1920, 1080)
+    for compressed in [gzip.compress(content), zlib.compress(content)]:
+        assert proto2ass(compressed, 1920, 1080) == expected
+        assert proto2ass(io.BytesIO(compressed), 1920, 1080) == expected
+    with open(file, 'rb') as f:
+        assert proto2ass(f, 1920, 1080) == expected
+    ass = Ass(1920, 1080, 0, "sans-serif", 25.0, 1.0, 5.0, 5.0, "", False, False, False)
+    try:
+        ass.add_bilibili_reader(io.BytesIO(content[:-3]))
+    except ValueError:
+        pass
+    else:
+        assert False, "a truncated segment should raise"
+    # a huge field length at the end of the input is reported as truncated, not allocated
+    for data in [b'\x0a\xff\xff\xff\xff\xff\xff\xff\xff\x7f', b'\x0a\xff\xff\xff\xff\x0f']:
+        try:
+            ass.add_bilibili_reader(io.BytesIO(data))
+        except ValueError as e:
+            assert "truncated" in str(e)
+        else:
+            assert False, "a huge length prefix should raise"
@@ -0,0 +1,58 @@
+import os
+import json
+from danmakuC import convert, convert_many
+
+file = os.path.join(os.path.dirname(__file__), 'test_dm.bin')
+
+
+def test_convert_many_in_order():
+    jobs = [file, {"file": file, "width": 1280, "height": 720}, {"file": file, "comment_filter": ["哈"]}]
+    expected = [convert(file), convert(file, 1280, 720), convert(file, comment_filter=["哈"])]
+    assert convert_many(jobs, max_workers=3) == expected
+
+
+def test_convert_many_exceptions():
+    results = convert_many([file, "not_exist.bin"], return_exceptions=True)
+    assert results[0] == convert(file)
+    assert isinstance(results[1], FileNotFoundError)
+
+
+def test_render_sizes():
+    sizes = [(1280, 720), (3840, 2160), (1920, 1080)]
+    expected = [convert(file, w, h) for w, h in sizes]
+    assert convert(file, sizes=sizes) == expected
+
+
+def test_render_sizes_niconico():
+    from danmakuC.niconico import json2ass
+    comments = [{"vposMs": i * 500, "postedAt": "2020-09-13T21:26:40+09:00", "commands": commands,
+                 "body": "コメント" * (i + 1)}
+                for i, commands in enumerate([[], ["big"], ["ue"], ["shita", "small"], ["naka"], ["big", "ender"]] * 4)]
+    data = json.dumps(comments)
+    sizes = [(1280, 720), (1440, 1080)]
+    assert json2ass(data, 1920, 1080, sizes=sizes) == [json2ass(data, w, h) for w, h in sizes]
+
+
+def test_write_targets(tmp_path):
+    import gzip
+    import io
+    expected = convert(file)
+    out = io.BytesIO()
+    convert(file, out_filename=out)
+    assert out.getvalue().decode('utf8') == expected
+    out = io.StringIO()
+    convert(file, out_filename=out)
+    assert out.getvalue() == expected
+    with open(tmp_path / "fd.ass", 'wb') as f:
+        convert(file, out_filename=f.fileno())
+        assert not f.closed
+    assert (tmp_path / "fd.ass").read_text(encoding='utf8') == expected
+    convert(file, out_filename=tmp_path / "dm.ass.gz")
+    assert gzip.decompress((tmp_path / "dm.ass.gz").read_bytes()).decode('utf8') == expected
+    out = io.BytesIO()
+    convert(file, out_filename=out, compress=True)
+    assert gzip.decompress(out.getvalue()).decode('utf8') == expected
+    sizes = [(1280, 720), (3840, 2160)]
+    convert(file, out_filename=tmp_path / "dm.ass.gz", sizes=sizes)
+    for (w, h), expected in zip(sizes, convert(file, sizes=sizes)):
+        assert gzip.decompress((tmp_path / f"dm_{w}x{h}.ass.gz").read_bytes()).decode('utf8') == expected
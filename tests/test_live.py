@@ -0,0 +1,46 @@
+import asyncio
+import json
+import os
+import re
+from danmakuC.bilibili import proto2ass
+from danmakuC.live import live2ass
+from danmakuC.niconico import json2ass
+from danmakuC.protobuf.bilibili import BiliCommentProto
+
+
+async def iterate(comments, delay_every: int = 0):
+    for i, comment in enumerate(comments):
+        if delay_every and i % delay_every == 0:
+            await asyncio.sleep(0)
+        yield comment
+
+
+def dialogues(filename: str) -> list:
+    with open(filename, encoding="utf8") as f:
+        return re.findall(r"^Dialogue: .*$", f.read(), re.M)
+
+
+def test_live_bilibili(tmp_path):
+    with open(os.path.join(os.path.dirname(__file__), "test_dm.bin"), "rb") as f:
+        data = f.read()
+    target = BiliCommentProto()
+    target.ParseFromString(data)
+    elems = sorted(target.elems, key=lambda e: (e.progress, e.ctime))
+    stats = {}
+    filenames = asyncio.run(live2ass(iterate(elems, 7), str(tmp_path / "live.ass"), 1920, 1080,
+                                     batch_size=16, queue_size=32, stats=stats))
+    assert filenames == [str(tmp_path / "live.ass")]
+    # comments arriving in order are laid out as in a whole conversion
+    assert dialogues(filenames[0]) == re.findall(r"^Dialogue: .*$", proto2ass(data, 1920, 1080), re.M)
+    assert stats["ass"]["comments"]["added"] == len(dialogues(filenames[0]))
+
+
+def test_live_niconico_rolling(tmp_path):
+    comments = [{"vposMs": i * 200, "body": f"comment {i}", "commands": ["184"] if i % 2 else ["ue"],
+                 "postedAt": "2023-01-01T00:00:00+09:00"} for i in range(200)]
+    filenames = asyncio.run(live2ass(iterate(comments, 10), str(tmp_path / "live_{index}.ass"), 1920, 1080,
+                                     platform="niconico", batch_size=10, roll_bytes=2048))
+    assert len(filenames) > 1 and all(os.path.getsize(f) < 4096 for f in filenames)
+    lines = [line for f in filenames for line in dialogues(f)]
+    data = {"data": {"threads": [{"fork": "main", "comments": comments}]}}
+    assert lines == re.findall(r"^Dialogue: .*$", json2ass(json.dumps(data), 1920, 1080, live=True), re.M)
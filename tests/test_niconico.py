@@ -0,0 +1,163 @@
+import gzip
+import io
+import json
+import zlib
+from datetime import datetime
+from danmakuC.ass import Ass
+from danmakuC.jsonstream import JsonStream, _walk
+from danmakuC.niconico import (NicoScriptEngine, compile_mail, iter_chats, json2ass, mail_style,
+                               parse_posted_at, proto2ass, process_mailstyle, xml2ass)
+from danmakuC.protobuf.niconico import NNDCommentProto
+
+
+def make_stream() -> bytes:
+    stream = b''
+    for i, (mail, content, fork) in enumerate([
+        ("184", "こんにちは", "main"),
+        ("shita red big", "下コメ", "main"),
+        ("ue #00ff00", "上コメ", "owner"),
+        ("naka small", "流れる\nコメント", "easy"),
+    ]):
+        comment = NNDCommentProto()
+        comment.no, comment.vpos, comment.date = i + 1, i * 150, 1600000000 + i
+        comment.mail, comment.content, comment.fork = mail, content, fork
+        data = comment.SerializeToString()
+        stream += len(data).to_bytes(4, byteorder='big') + data
+    return stream
+
+
+def python_proto2ass(stream: bytes, width: int, height: int) -> str:
+    """reference conversion through the Python protobuf runtime"""
+    ass = Ass(width, height, 0, "sans-serif", 25.0, 1.0, 5.0, 5.0, "", False, False, False)
+    comment = NNDCommentProto()
+    while stream:
+        size = int.from_bytes(stream[:4], byteorder='big')
+        comment.ParseFromString(stream[4:4 + size])
+        stream = stream[4 + size:]
+        style, _ = process_mailstyle(comment.mail, {"pos": 0, "size": 1, "color": 0xFFFFFF, "font": "defont"})
+        ass.add_comment(comment.vpos / 100, comment.date, comment.content, style["size"], style["pos"],
+                        style["color"], 1 if comment.fork == "owner" else 0)
+    return ass.to_string()
+
+
+def test_native_stream_decoder(tmp_path):
+    stream = make_stream()
+    expected = python_proto2ass(stream, 1920, 1080)
+    assert proto2ass(stream, 1920, 1080) == expected
+    path = tmp_path / "comments.bin"
+    path.write_bytes(stream + b'\x00\x00\x00\x00')
+    assert proto2ass(path, 1920, 1080) == expected
+    gz_path = tmp_path / "comments.bin.gz"
+    gz_path.write_bytes(gzip.compress(stream))
+    assert proto2ass(gz_path, 1920, 1080) == expected
+    assert proto2ass(zlib.compress(stream), 1920, 1080) == expected
+    # a huge frame size followed by EOF is reported as truncated, not allocated
+    path.write_bytes(b'\xff\xff\xff\xff')
+    ass = Ass(1920, 1080, 0, "sans-serif", 25.0, 1.0, 5.0, 5.0, "", False, False, False)
+    for read in [lambda: ass.add_niconico_file(str(path), mail_style),
+                 lambda: ass.add_niconico_reader(io.BytesIO(path.read_bytes()), mail_style)]:
+        try:
+            read()
+        except ValueError as e:
+            assert "truncated" in str(e)
+        else:
+            assert False, "a huge length prefix should raise"
+
+
+def test_stream_counts():
+    ass = Ass(1920, 1080, 0, "sans-serif", 25.0, 1.0, 5.0, 5.0, "コメ", False, False, False)
+    calls = []
+    counts = ass.add_niconico_stream(make_stream() * 2, lambda mail: calls.append(mail) or (0, 1.0, 0xFFFFFF))
+    assert counts == {"parsed": 8, "added": 2, "filtered": 6, "skipped": 0}
+    assert len(calls) == 4
+
+
+def test_json_stream():
+    def comment(no, vpos, body):
+        return {"no": no, "vposMs": vpos, "body": body, "commands": ["184"], "postedAt": "2023-01-02T03:04:05+09:00"}
+    threads = [
+        {"id": "1", "fork": "owner", "comments": [comment(2, 2000, "@デフォルト"), comment(1, 1000, "いえーい")]},
+        {"id": "2", "fork": "main", "comments": [comment(i, i * 100, "x" * (i % 7) + "\"é") for i in range(300)]},
+    ]
+    expected = [("owner", threads[0]["comments"][1]), ("owner", threads[0]["comments"][0])] + \
+               [("main", c) for c in threads[1]["comments"]]
+    response = json.dumps({"meta": {"status": 200}, "data": {"threads": threads}}, ensure_ascii=False)
+    for chunk_size in (1, 7, 1 << 16):
+        assert list(_walk(JsonStream(io.BytesIO(response.encode()), chunk_size), "")) == expected
+    assert list(_walk(JsonStream(json.dumps(threads)), "")) == expected
+    assert list(_walk(JsonStream(json.dumps(threads[1]).encode()), "")) == expected[2:]
+    assert list(_walk(JsonStream(json.dumps(threads[1]["comments"])), "")) == [("", c) for c in threads[1]["comments"]]
+    ass = json2ass(response.encode(), 1920, 1080)
+    assert ass == json2ass(gzip.compress(response.encode()), 1920, 1080)
+    assert ass.count("Dialogue:") == 301
+
+
+def test_parse_posted_at():
+    for posted_at in ("2023-01-02T03:04:05+09:00", "2023-01-02T03:04:59-05:30", "2023-01-02T03:04:05.250000+00:00"):
+        assert parse_posted_at(posted_at) == int(datetime.fromisoformat(posted_at).timestamp())
+        assert parse_posted_at(posted_at) == int(datetime.fromisoformat(posted_at).timestamp())
+
+
+def test_xml_chats(tmp_path):
+    chats = "".join(f'<chat thread="1" no="{i}" vpos="{i * 50}" date="{1600000000 + i}" mail="184">c{i}&amp;</chat>'
+                    for i in range(500))
+    xml = ('<?xml version="1.0" encoding="UTF-8"?><packet><thread thread="1"><chat>nested</chat></thread>'
+           '<chat vpos="0" date="0" mail="" fork="owner">@デフォルト</chat>' + chats + '</packet>')
+    texts = [chat.text for chat in iter_chats(io.BytesIO(xml.encode()))]
+    assert texts == ["@デフォルト"] + [f"c{i}&" for i in range(500)]
+    ass = xml2ass(xml, 1920, 1080)
+    assert ass.count("Dialogue:") == 500
+    assert xml2ass(xml.encode(), 1920, 1080) == ass
+    path = tmp_path / "comments.xml.gz"
+    path.write_bytes(gzip.compress(xml.encode()))
+    with open(path, "rb") as f:
+        assert xml2ass(f, 1920, 1080) == ass
+
+
+def test_nicoscript_per_conversion():
+    script = '<chat vpos="100" date="0" mail="@10" fork="owner">@置換 草 www 全</chat>'
+    chats = '<chat vpos="{}" date="0" mail="">草</chat>'
+    ass = xml2ass(f'<packet>{chats.format(0)}{script}{chats.format(500)}{chats.format(5000)}</packet>', 1920, 1080)
+    texts = [line.rsplit("}", 1)[-1].strip("\u200b") for line in ass.splitlines() if line.startswith("Dialogue:")]
+    # a script applies within its duration to the comments after it
+    assert texts == ["草", "www", "草"]
+    # scripts of a conversion do not leak into the next one
+    assert "www" not in xml2ass(f'<packet>{chats.format(500)}</packet>', 1920, 1080)
+
+
+def test_nicoscript_index():
+    import random
+    rnd = random.Random(0)
+    engine = NicoScriptEngine()
+    style = {"pos": 0, "size": 1, "color": 0xFFFFFF, "font": "defont"}
+    for i in range(600):
+        start = rnd.choice([rnd.randint(0, 300), 100.0])
+        assert engine.add(f"@置換 a{i} b", start, rnd.choice([0, 1, 30, 300]), style)
+        # lookups between additions, at bounds and between them, against a scan of every script
+        for vpos in [rnd.uniform(-10, 700), 100.0, start]:
+            expected = [s for s in engine.scripts if s["start"] <= vpos <= s["end"]]
+            assert engine.active(vpos) == expected
+    assert len(engine.indexes) == bin(600).count("1")
+
+
+def test_compiled_mail():
+    style, commands = process_mailstyle("shita naka RED big 3sec", {"pos": 0, "size": 1, "color": 0, "font": "defont"})
+    assert style == {"pos": 2, "size": 13 / 9, "color": 0xff0000, "font": "defont", "alpha": 1}
+    assert commands["duration"] == 3.0 and not commands["full"]
+    # naka does not undo a nicoscript reversal, other positions do
+    assert process_mailstyle(["naka", "red"], {"pos": 3, "size": 1, "color": 0, "font": "defont"})[0]["pos"] == 3
+    assert process_mailstyle(["ue", "naka"], {"pos": 3, "size": 1, "color": 0, "font": "defont"})[0]["pos"] == 1
+    assert compile_mail("shita naka RED big 3sec") is compile_mail("shita naka RED big 3sec")
+    from concurrent.futures import ThreadPoolExecutor
+
+    def run(color: int) -> dict:
+        stats = {}
+        xml = '<packet>' + f'<chat vpos="0" date="0" mail="184 ue #{color:06x}">a</chat>' * 10 + '</packet>'
+        xml2ass(xml, 1920, 1080, stats=stats)
+        return stats["mail_cache"]
+
+    # concurrent conversions only count their own lookups
+    with ThreadPoolExecutor(4) as executor:
+        for cache in executor.map(run, range(0x123400, 0x123408)):
+            assert (cache["hits"], cache["misses"], cache["hit_rate"]) == (9, 1, 0.9)
+    assert run(0x123400)["hits"] == 10